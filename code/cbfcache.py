@@ -0,0 +1,143 @@
+"""Persistent on-disk memo of find_params results.
+
+The same entry counts show up in many rounds, in the proto1/proto2/retronly
+variants and in every re-run of the scripts. ParamCache stores the solved
+(hash_functions, slots, prob) tuples in a small SQLite database keyed by
+(entries, target, deviation, dlbase), so they only have to be solved once.
+Every version of the solvers (cbfparams.VERSION) has a table of its own, and
+the tables of other versions are dropped when the cache is opened.
+The database is bounded: once it holds more than max_entries rows, the least
+recently used ones are evicted.
+"""
+
+import os
+import sqlite3
+
+import cbfparams
+
+# Where the cache lives unless a path is given. Relative to the working
+# directory, i.e. next to rounds_agg.csv.
+DEFAULT_PATH = os.environ.get("CBFPARAMS_CACHE", "cbfparams-cache.sqlite")
+DEFAULT_MAX_ENTRIES = 1000000
+# SQLite limits the number of host parameters per statement
+_CHUNK = 200
+
+
+class ParamCache(object):
+    """LRU-bounded SQLite cache for find_params results."""
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 version=cbfparams.VERSION):
+        self.path = path
+        self.table = "params_v{0}".format(version)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.db = sqlite3.connect(path)
+        stale = [row[0] for row in self.db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND "
+            "name LIKE 'params%' AND name != ?", (self.table,))]
+        for name in stale:
+            self.db.execute("DROP TABLE " + name)
+        self.db.execute("CREATE TABLE IF NOT EXISTS " + self.table + " ("
+                        "entries REAL, target REAL, deviation REAL, "
+                        "dlbase REAL, hash_functions REAL, slots REAL, "
+                        "prob REAL, used INTEGER, "
+                        "PRIMARY KEY (entries, target, deviation, dlbase))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS " + self.table +
+                        "_used ON " + self.table + " (used)")
+        self.db.commit()
+        row = self.db.execute("SELECT MAX(used) FROM " +
+                              self.table).fetchone()
+        self.clock = row[0] or 0
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM " +
+                               self.table).fetchone()[0]
+
+    def get(self, entries, target, deviation, dlbase=4.0):
+        """Return the cached (hash_functions, slots, prob) or None."""
+        return self.get_many([entries], target, deviation,
+                             dlbase).get(entries)
+
+    def get_many(self, entries, target, deviation, dlbase=4.0):
+        """Look up a sequence of entry counts.
+
+        Returns a dict mapping every entry count that was found to its
+        (hash_functions, slots, prob) tuple.
+        """
+        entries = list(entries)
+        found = {}
+        for i in range(0, len(entries), _CHUNK):
+            chunk = entries[i:i + _CHUNK]
+            rows = self.db.execute(
+                "SELECT entries, hash_functions, slots, prob FROM " +
+                self.table + " WHERE target = ? AND deviation = ? AND "
+                "dlbase = ? AND entries IN (" + ", ".join("?" * len(chunk)) + ")",
+                [target, deviation, dlbase] + [float(e) for e in chunk])
+            byvalue = dict((row[0], tuple(row[1:])) for row in rows)
+            for e in chunk:
+                if float(e) in byvalue:
+                    found[e] = byvalue[float(e)]
+        self.hits += len(found)
+        self.misses += len(entries) - len(found)
+        if found:
+            self.clock += 1
+            self.db.executemany(
+                "UPDATE " + self.table + " SET used = ? WHERE entries = ? AND "
+                "target = ? AND deviation = ? AND dlbase = ?",
+                [(self.clock, float(e), target, deviation, dlbase)
+                 for e in found])
+            self.db.commit()
+        return found
+
+    def put(self, entries, target, deviation, dlbase, params):
+        """Store a single (hash_functions, slots, prob) tuple."""
+        self.put_many({entries: params}, target, deviation, dlbase)
+
+    def put_many(self, results, target, deviation, dlbase=4.0):
+        """Store a dict mapping entry counts to find_params results."""
+        if not results:
+            return
+        self.clock += 1
+        self.db.executemany(
+            "INSERT OR REPLACE INTO " + self.table +
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(float(e), target, deviation, dlbase, float(p[0]), float(p[1]),
+              float(p[2]), self.clock) for e, p in results.items()])
+        self.stores += len(results)
+        self._evict()
+        self.db.commit()
+
+    def _evict(self):
+        """Drop the least recently used rows above max_entries."""
+        excess = len(self) - self.max_entries
+        if excess <= 0:
+            return
+        self.db.execute("DELETE FROM " + self.table + " WHERE rowid IN "
+                        "(SELECT rowid FROM " + self.table +
+                        " ORDER BY used LIMIT ?)", (excess,))
+        self.evictions += excess
+
+    def stats(self):
+        """Return a dict with the statistics of this session."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "size": len(self),
+            "max_entries": self.max_entries,
+        }
+
+    def summary(self):
+        """Return the statistics as a single line for the scripts' output."""
+        return ("Parameter cache {0}: {hits} hits, {misses} misses, "
+                "{stores} stored, {evictions} evicted, "
+                "{size}/{max_entries} entries".format(self.path,
+                                                      **self.stats()))
+
+    def close(self):
+        self.db.close()
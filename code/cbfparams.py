@@ -0,0 +1,353 @@
+"""Shared VI-CBF parameter calculations for the cbfperf scripts.
+
+calculate_fpr is the formula from the thesis, find_params determines the
+number of hash functions and slots required to hit a target FPR. Two solvers
+are available:
+
+* "walk" is the original search that moves the slot count by one per step
+  and flips the number of hash functions back and forth. It needs roughly as
+  many iterations as there are entries, which is fine for u1000 but takes
+  hours for u100000.
+* "bisect" brackets the smallest acceptable slot count for each candidate
+  number of hash functions and bisects on it. It returns the same
+  (hash_functions, slots, prob) tuple after a few dozen FPR evaluations per
+  candidate.
+
+calculate_fpr_array and find_params_batch are the NumPy counterparts. They
+evaluate whole grids of (n, m, l, k) in one call and solve many entry counts
+at once, which is what sweeps over large parameter ranges should use.
+
+find_params_sequence is the incremental mode for the monotonically growing
+entry counts of the simulation rounds: it solves the entry counts in sorted
+order and seeds each solve with the neighbouring solution, so only a short
+local search around the previous (k, slots) remains per value.
+
+find_params_multi solves several target FPRs for the same entry count in one
+sweep over k. The FPR evaluations are shared between the targets, and the
+slot count found for a looser target bounds the search for the tighter ones.
+"""
+
+import numpy as np
+from scipy.special import binom
+
+# Default number of hash functions after which the bisect solver gives up
+MAX_HASH_FUNCTIONS = 64
+# Version of the find_params results. Bump it whenever a change to the
+# solvers can change what they return, so that cbfcache.ParamCache stops
+# handing out the results of the old version.
+VERSION = 1
+
+
+def calculate_fpr(n, m, l, k):
+    """Calculate the FPR for given parameters."""
+    return pow(1.0 - pow(1.0 - 1.0 / m, n * k) - ((l - 1.0) / l) *
+               n * k * (1.0 / m) * pow(1.0 - (1.0 / m), n * k - 1.0) -
+               (((l - 1.0) * (l + 1)) / (6.0 * pow(l, 2.0))) *
+               binom(n * k, 2.0) * pow(1.0 / m, 2.0) *
+               pow(1.0 - (1.0 / m), n * k - 2.0),
+               k)
+
+
+def find_params(entries, target=0.01, deviation=0.0001, dlbase=4.0,
+                mode="bisect"):
+    """Determine the more-or-less optimal parameters for the given values.
+
+    Returns a (hash_functions, slots, prob) tuple. mode selects the solver,
+    see the module docstring.
+    """
+    if mode == "walk":
+        return _find_params_walk(entries, target, deviation, dlbase)
+    elif mode == "bisect":
+        return _find_params_bisect(entries, target, deviation, dlbase)
+    raise ValueError("Unknown solver mode: " + str(mode))
+
+
+def _find_params_walk(entries, target, deviation, dlbase):
+    """Original unit-step search over the number of slots."""
+    entries = float(entries)
+    hash_functions = 1
+    slots = entries
+    last = 0.0
+    change_k = False
+    while True:
+        prob = calculate_fpr(entries, slots, dlbase, hash_functions)
+        if prob - target > deviation:
+            # FPR is still too high, increase parameters
+            if last > prob:
+                # FPR has decreased since last step
+                hash_functions += 1.0
+                change_k = True
+            else:
+                # FPR has increased since last step
+                if change_k:
+                    hash_functions -= 1.0
+                    change_k = False
+                    slots += 1
+                else:
+                    hash_functions += 1.0
+                    change_k = True
+        elif prob - target < -deviation:
+            # FPR is too low, decrease parameters
+            slots -= 1
+            change_k = False
+        else:
+            break
+        last = prob
+    return hash_functions, slots, prob
+
+
+def min_slots(entries, hash_functions, limit, dlbase=4.0, lo=None, hi=None,
+              evaluate=None):
+    """Return the smallest slot count whose FPR does not exceed limit.
+
+    The FPR is monotonically decreasing in the number of slots, so the
+    answer is bracketed by doubling and then bisected. lo and hi may be
+    passed as a known bracket (lo too small, hi large enough). evaluate is
+    an optional function slots => FPR to use instead of calculate_fpr, e.g.
+    a memoized one. Returns a (slots, prob) tuple.
+    """
+    entries = float(entries)
+    if evaluate is None:
+        def evaluate(slots):
+            return calculate_fpr(entries, slots, dlbase, hash_functions)
+    if lo is None:
+        lo = 0.0
+    if hi is None:
+        hi = max(entries, 2.0)
+    while evaluate(hi) > limit:
+        lo = hi
+        hi *= 2.0
+    lo, hi = float(lo), float(hi)
+    while hi - lo > 1.0:
+        mid = float(int((lo + hi) / 2.0))
+        if mid < 2.0:
+            # The formula is undefined for a single slot
+            lo = mid
+        elif evaluate(mid) > limit:
+            lo = mid
+        else:
+            hi = mid
+    return hi, float(evaluate(hi))
+
+
+def _find_params_bisect(entries, target, deviation, dlbase):
+    """Bisect the slot count for each candidate number of hash functions."""
+    entries = float(entries)
+    limit = target + deviation
+    best = None
+    for hash_functions in range(1, MAX_HASH_FUNCTIONS + 1):
+        hi = None
+        if best is not None:
+            # Only worth bisecting if k + 1 beats the best slot count so far,
+            # which a single evaluation just below it tells us.
+            hi = best[1] - 1.0
+            if hi < 2.0 or calculate_fpr(entries, hi, dlbase,
+                                         hash_functions) > limit:
+                break
+        slots, prob = min_slots(entries, hash_functions, limit, dlbase,
+                                hi=hi)
+        best = (float(hash_functions), slots, prob)
+    return best
+
+
+def find_params_multi(entries, targets, dlbase=4.0):
+    """Solve find_params for several (target, deviation) pairs at once.
+
+    Returns a dict mapping each (target, deviation) pair to the same
+    (hash_functions, slots, prob) tuple find_params would return for it.
+    """
+    entries = float(entries)
+    # Looser limits need fewer slots, so solve them first
+    limits = sorted(set(t + d for t, d in targets), reverse=True)
+    best = {}
+    done = set()
+    for hash_functions in range(1, MAX_HASH_FUNCTIONS + 1):
+        if len(done) == len(limits):
+            break
+        memo = {}
+
+        def evaluate(slots):
+            if slots not in memo:
+                memo[slots] = calculate_fpr(entries, slots, dlbase,
+                                            hash_functions)
+            return memo[slots]
+
+        for limit in limits:
+            if limit in done:
+                continue
+            hi = None
+            if limit in best:
+                # Only worth bisecting if k beats the best slot count so far
+                hi = best[limit][1] - 1.0
+                if hi < 2.0 or evaluate(hi) > limit:
+                    done.add(limit)
+                    continue
+            # Every FPR evaluated for another target with this k narrows
+            # the bracket for this one as well.
+            lo = max([0.0] + [m for m, p in memo.items() if p > limit])
+            above = [m for m, p in memo.items() if p <= limit]
+            if above:
+                hi = min(above + ([hi] if hi is not None else []))
+            slots, prob = min_slots(entries, hash_functions, limit, dlbase,
+                                    lo=lo, hi=hi, evaluate=evaluate)
+            best[limit] = (float(hash_functions), slots, prob)
+    return dict(((t, d), best[t + d]) for t, d in targets)
+
+
+def min_slots_near(entries, hash_functions, limit, guess, dlbase=4.0):
+    """min_slots, starting from a guess that is probably close.
+
+    Gallops away from the guess in doubling steps until the answer is
+    bracketed, then bisects. Needs about 2 * log2(|guess - answer|) FPR
+    evaluations. Returns a (slots, prob) tuple.
+    """
+    entries = float(entries)
+    guess = max(float(int(guess)), 2.0)
+    step = 1.0
+    if calculate_fpr(entries, guess, dlbase, hash_functions) > limit:
+        lo = guess
+        while True:
+            hi = lo + step
+            if calculate_fpr(entries, hi, dlbase, hash_functions) <= limit:
+                break
+            lo = hi
+            step *= 2.0
+    else:
+        hi = guess
+        while True:
+            lo = hi - step
+            if lo < 2.0:
+                lo = 0.0
+                break
+            if calculate_fpr(entries, lo, dlbase, hash_functions) > limit:
+                break
+            hi = lo
+            step *= 2.0
+    return min_slots(entries, hash_functions, limit, dlbase, lo=lo, hi=hi)
+
+
+def refine_params(entries, hash_functions, slots, target=0.01,
+                  deviation=0.0001, dlbase=4.0):
+    """Find the optimal parameters close to a known (k, slots) estimate.
+
+    The slot count is solved for the given k, then k is moved up or down for
+    as long as that still saves slots. Returns the same (hash_functions,
+    slots, prob) tuple as find_params.
+    """
+    entries = float(entries)
+    limit = target + deviation
+    k = int(hash_functions)
+    best = (float(k),) + min_slots_near(entries, k, limit, slots, dlbase)
+    for direction in (1, -1):
+        k = int(best[0]) + direction
+        while 1 <= k <= MAX_HASH_FUNCTIONS:
+            # Only worth solving if k beats the best slot count so far. Ties
+            # go to the smaller k, just like in the cold solver.
+            hi = best[1] - 1.0 if direction > 0 else best[1]
+            if hi < 2.0 or calculate_fpr(entries, hi, dlbase, k) > limit:
+                break
+            best = (float(k),) + min_slots(entries, k, limit, dlbase, hi=hi)
+            k += direction
+    return best
+
+
+def find_params_sequence(entries, target=0.01, deviation=0.0001,
+                         dlbase=4.0, start=None):
+    """Solve many entry counts, warm-starting each from its neighbour.
+
+    The distinct entry counts are solved in ascending order. The first one
+    is solved from scratch, unless a known (entries, params) solution is
+    passed as start. Every following one starts from the previous solution
+    with the slot count scaled by the growth in entries. Returns a dict
+    mapping each entry count to its (hash_functions, slots, prob).
+    """
+    results = {}
+    last = start
+    for value in sorted(set(entries)):
+        if last is None or float(last[0]) <= 0.0:
+            params = find_params(value, target, deviation, dlbase)
+        else:
+            guess = last[1][1] * float(value) / float(last[0])
+            params = refine_params(value, last[1][0], guess, target,
+                                   deviation, dlbase)
+        results[value] = params
+        last = (value, params)
+    return results
+
+
+def calculate_fpr_array(n, m, l, k):
+    """Calculate the FPR for arrays of parameters.
+
+    Same formula as calculate_fpr, but the arguments may be NumPy arrays (or
+    scalars) of any shape that broadcast against each other. Use fpr_grid
+    to evaluate the full outer product of parameter vectors.
+    """
+    n, m, l, k = [np.asarray(x, dtype=np.float64) for x in (n, m, l, k)]
+    nk = n * k
+    keep = 1.0 - 1.0 / m
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        base = (1.0 - np.power(keep, nk) - ((l - 1.0) / l) *
+                nk * (1.0 / m) * np.power(keep, nk - 1.0) -
+                (((l - 1.0) * (l + 1)) / (6.0 * np.power(l, 2.0))) *
+                binom(nk, 2.0) * np.power(1.0 / m, 2.0) *
+                np.power(keep, nk - 2.0))
+        return np.power(base, k)
+
+
+def fpr_grid(entries, slots, dlbase, hash_functions):
+    """Evaluate the FPR on the grid entries x slots x dlbase x hash_functions.
+
+    Each argument is a scalar or a 1-d sequence, the result has the shape
+    (len(entries), len(slots), len(dlbase), len(hash_functions)).
+    """
+    n, m, l, k = np.ix_(*[np.atleast_1d(np.asarray(x, dtype=np.float64))
+                          for x in (entries, slots, dlbase, hash_functions)])
+    return calculate_fpr_array(n, m, l, k)
+
+
+def min_slots_array(entries, hash_functions, limit, dlbase=4.0):
+    """Vectorized min_slots for broadcastable arrays of entries and k.
+
+    Returns (slots, prob) arrays with the broadcast shape of the inputs.
+    """
+    entries, hash_functions = np.broadcast_arrays(
+        np.asarray(entries, dtype=np.float64),
+        np.asarray(hash_functions, dtype=np.float64))
+    lo = np.zeros(entries.shape)
+    hi = np.maximum(entries, 2.0)
+    # Bracket by doubling every element that is still too small
+    while True:
+        high = calculate_fpr_array(entries, hi, dlbase, hash_functions) > limit
+        if not high.any():
+            break
+        lo = np.where(high, hi, lo)
+        hi = np.where(high, hi * 2.0, hi)
+    while True:
+        active = hi - lo > 1.0
+        if not active.any():
+            break
+        mid = np.floor((lo + hi) / 2.0)
+        # The formula is undefined for a single slot
+        high = (mid < 2.0) | (calculate_fpr_array(
+            entries, np.maximum(mid, 2.0), dlbase, hash_functions) > limit)
+        lo = np.where(active & high, mid, lo)
+        hi = np.where(active & ~high, mid, hi)
+    return hi, calculate_fpr_array(entries, hi, dlbase, hash_functions)
+
+
+def find_params_batch(entries, target=0.01, deviation=0.0001, dlbase=4.0,
+                      max_hash_functions=MAX_HASH_FUNCTIONS):
+    """Solve find_params for a whole sequence of entry counts at once.
+
+    All entry counts and all candidate numbers of hash functions are bisected
+    together, then the cheapest k is picked per entry count. Returns three
+    arrays (hash_functions, slots, prob) in the order of entries.
+    """
+    entries = np.atleast_1d(np.asarray(entries, dtype=np.float64))
+    ks = np.arange(1, max_hash_functions + 1, dtype=np.float64)
+    slots, prob = min_slots_array(entries[:, np.newaxis], ks[np.newaxis, :],
+                                  target + deviation, dlbase)
+    # argmin picks the smallest k on ties, just like the scalar solver
+    best = np.argmin(slots, axis=1)
+    rows = np.arange(len(entries))
+    return ks[best], slots[rows, best], prob[rows, best]
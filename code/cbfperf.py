@@ -0,0 +1,321 @@
+"""Calculate the VI-CBF scaling tables for all protocols and target FPRs.
+
+Reads rounds_agg.csv once, derives the entry counts of every protocol from
+it, solves each distinct entry count once for all target FPRs and writes
+every vicbf-scaling-fpr<target>-<protocol>.csv table in a single run.
+
+Usage: python cbfperf.py [-r rounds_agg.csv] [-j JOBS] [-f FPR ...]
+                         [-s calibrated|constant|model|measured|pyvicbf]
+                         [protocol ...]
+
+Without arguments, all protocols are calculated for all target FPRs. The
+cbfperf-{,v2-,v3-}fpr*.py scripts are shortcuts for a single protocol and
+target.
+
+The serialized sizes (the _lu and _lc columns) are slots + 10 bytes,
+compressed by the ratio interpolated from the calibration table in
+vicbfratio.py for the fill of the filter, by default. -s constant uses a
+fixed ratio of 52% instead, like the original scripts. -s model predicts
+the compressed size of every filter from its expected counter histogram
+(see vicbfmodel.py). With -s measured, real filters are built and
+compressed for every entry count up to vicbfsize.MEASURE_LIMIT (with the
+bulk builder in vicbfsize.py, -s pyvicbf uses pyVICBF instead, which is
+much slower). Larger entry counts keep the calibrated estimate.
+"""
+
+import argparse
+import math
+
+import numpy as np
+
+import cbfcache
+import cbfparams
+import cbfsched
+import vicbfmodel
+import vicbfratio
+import vicbfsize
+from columns import load_columns
+
+# (target, deviation) pairs that can be calculated
+TARGETS = [(0.1, 0.001), (0.01, 0.0001), (0.001, 0.0001)]
+# Number of sorted entry counts each worker solves with warm starts
+CHUNK = 25
+
+
+class Protocol(object):
+    """How the entry counts of a protocol are derived from the rounds.
+
+    series is a list of (key, label, plus, minus) tuples, one per group of
+    five output columns. key names the series and is unique per protocol,
+    label is the column prefix in the output header, plus and minus are the
+    names of the rounds_agg.csv columns that are added up and subtracted to
+    get the entry count of the series.
+    """
+
+    def __init__(self, name, series):
+        self.name = name
+        self.series = series
+
+    def columns(self):
+        """Return the rounds_agg.csv columns the protocol needs."""
+        return set(c for _, _, plus, minus in self.series
+                   for c in plus + minus)
+
+    def entries(self, cols):
+        """Return an array of entry counts per series for all rounds."""
+        return [sum(cols[c] for c in plus) - sum(cols[c] for c in minus)
+                for _, _, plus, minus in self.series]
+
+    def header(self):
+        return "round " + " ".join(
+            "{0}_hf {0}_slots {0}_prob {0}_lu {0}_lc".format(label)
+            for _, label, _, _ in self.series) + "\n"
+
+
+PROTOCOLS = [
+    # Protocol 1
+    Protocol("proto1", [
+        ("nor_med", "nor_med", ["sharenoretr_median"], []),
+        ("nor_min", "nor_min", ["sharenoretr_min"], []),
+        ("nor_max", "nor_max", ["sharenoretr_max"], []),
+        ("nvr_med", "nvr_med", ["shareneverretr_median"], []),
+        ("nvr_min", "nvr_min", ["shareneverretr_min"], []),
+        # The original tables label the max columns nvr_min as well
+        ("nvr_max", "nvr_min", ["shareneverretr_max"], []),
+    ]),
+    # Protocol 2
+    Protocol("proto2", [
+        ("nor_med", "nor_med", ["sharenoretr_median"], ["shareops_median"]),
+        ("nor_min", "nor_min", ["sharenoretr_min"], ["shareops_min"]),
+        ("nor_max", "nor_max", ["sharenoretr_max"], ["shareops_max"]),
+        ("nvr_med", "nvr_med", ["shareneverretr_median"], ["shareops_median"]),
+        ("nvr_min", "nvr_min", ["shareneverretr_min"], ["shareops_min"]),
+        ("nvr_max", "nvr_min", ["shareneverretr_max"], ["shareops_max"]),
+    ]),
+    # Hypothetical case without any orphans
+    Protocol("retronly", [
+        ("r_med", "r_med", ["sharenoretr_median"], ["shareneverretr_median"]),
+        ("r_min", "r_min", ["sharenoretr_min"], ["shareneverretr_min"]),
+        ("r_max", "r_max", ["sharenoretr_max"], ["shareneverretr_max"]),
+    ]),
+]
+
+
+def find_params_chunk(args):
+    """Solve a sorted chunk of entry counts for all targets.
+
+    The first entry count is solved for all targets in one sweep, the
+    following ones are warm-started from their smaller neighbour.
+    """
+    chunk, targets = args
+    first = cbfparams.find_params_multi(chunk[0], targets)
+    return dict((t, cbfparams.find_params_sequence(
+        chunk, t[0], t[1], start=(chunk[0], first[t]))) for t in targets)
+
+
+def chunk_cost(args):
+    """Rough relative cost of find_params_chunk, grows with the entries."""
+    return sum(math.log(max(val, 0) + 2.0) for val in args[0])
+
+
+def to_vicbf(params):
+    """Create a VICBF with given parameters and return the serialized sizes."""
+    # pyVICBF is only needed here, not for calculating the parameters
+    from vicbf.vicbf import VICBF
+    import zlib
+    entries = int(float(params[0]))
+    hash_functions = int(float(params[1]))
+    slots = int(float(params[2]))
+
+    v = VICBF(int(slots), int(hash_functions))
+    for k in range(int(entries)):
+        v.insert(k)
+    serialized = v.serialize().tobytes()
+    compressed = zlib.compress(serialized, 6)
+    return len(serialized), len(compressed)
+
+
+def read_rounds(path, protocols):
+    """Return {protocol name: {round: [entry count per series]}}."""
+    names = set(["round"])
+    for p in protocols:
+        names |= p.columns()
+    cols = load_columns(path, sorted(names), dtype=np.int64)
+    # Round 0 is the initial state without any shares
+    rounds = cols["round"]
+    keep = np.nonzero(rounds != 0)[0]
+    data = {}
+    for p in protocols:
+        series = p.entries(cols)
+        data[p.name] = dict((int(rounds[i]), [int(s[i]) for s in series])
+                            for i in keep)
+    return data
+
+
+def solve(values, targets, scheduler):
+    """Return {(target, deviation): {entries: params}} for all values."""
+    cache = cbfcache.ParamCache()
+    params = dict((t, cache.get_many(values, *t)) for t in targets)
+    todo = sorted(val for val in values
+                  if any(val not in params[t] for t in targets))
+    chunks = dict((i, (todo[i:i + CHUNK], targets))
+                  for i in range(0, len(todo), CHUNK))
+    for _, solved in scheduler.map(find_params_chunk, chunks, chunk_cost):
+        for t in targets:
+            params[t].update(solved[t])
+    for t in targets:
+        cache.put_many(dict((i, params[t][i]) for i in todo), *t)
+    print(cache.summary())
+    cache.close()
+    return params
+
+
+def measure_sizes(values, targets, params, scheduler, function):
+    """Measure the serialized sizes of the filters for all values.
+
+    function is vicbfsize.measure or to_vicbf. Returns {(target, deviation):
+    {entries: (uncompressed, compressed)}} for every entry count up to
+    vicbfsize.MEASURE_LIMIT, biggest filters first.
+    """
+    tasks = dict(((t, val), (val, params[t][val][0], params[t][val][1]))
+                 for t in targets for val in values
+                 if 0 <= val <= vicbfsize.MEASURE_LIMIT)
+    sizes = dict((t, {}) for t in targets)
+    for (t, val), size in scheduler.map(function, tasks,
+                                        vicbfsize.measure_cost):
+        sizes[t][val] = size
+    return sizes
+
+
+def calibrated_sizes(values, targets, params):
+    """Estimate the serialized sizes of the filters for all values.
+
+    Returns {(target, deviation): {entries: (uncompressed, compressed)}} of
+    the full serialization, compressed by the ratio from the calibration
+    table of vicbfratio.py.
+    """
+    table = vicbfratio.RatioTable.load()
+    sizes = dict((t, {}) for t in targets)
+    for t in targets:
+        for val in values:
+            hash_functions, slots = params[t][val][:2]
+            ratio = table.ratio(
+                vicbfratio.fill(max(val, 0), hash_functions, slots),
+                hash_functions)
+            sizes[t][val] = (int(slots) + 10,
+                             int(round((slots + 10) * ratio)))
+    return sizes
+
+
+def model_sizes(values, targets, params):
+    """Predict the serialized sizes of the filters for all values.
+
+    Returns {(target, deviation): {entries: (uncompressed, compressed)}} of
+    the full serialization, as vicbfmodel.CompressionModel predicts them.
+    """
+    model = vicbfmodel.CompressionModel.calibrate()
+    values = sorted(values)
+    sizes = {}
+    for t in targets:
+        hash_functions, slots = np.array(
+            [params[t][val][:2] for val in values], dtype=np.float64).T
+        predicted = model.predict(np.array(values, dtype=np.float64),
+                                  hash_functions, slots)
+        sizes[t] = dict(
+            (val, (int(full), int(round(compressed))))
+            for val, full, compressed in zip(
+                values, predicted["full"], predicted["full_compressed"]))
+    return sizes
+
+
+def format_params(n, size=None):
+    """Format a find_params result as the five columns of a series.
+
+    size is the measured (uncompressed, compressed) size, if there is one.
+    """
+    if size is None:
+        size = (int(n[1]) + 10, int(round((n[1] + 10) * 0.52)))
+    return " ".join([str(n[0]), str(n[1]), str(n[2]), str(size[0]),
+                     str(size[1])])
+
+
+def write_table(path, protocol, data, params, sizes):
+    with open(path, "w") as fo:
+        fo.write(protocol.header())
+        for rnd in sorted(data.keys()):
+            fo.write(str(rnd) + " " + " ".join(
+                format_params(params[val], sizes.get(val))
+                for val in data[rnd]) + "\n")
+
+
+def main(protocols=None, targets=None, rounds="rounds_agg.csv",
+         workers=None, sizes="calibrated"):
+    """Calculate and write the tables for the given protocols and targets.
+
+    protocols is a list of protocol names and targets a list of (target,
+    deviation) pairs, both default to everything. workers is the number of
+    worker processes (default: one per CPU). sizes is one of "calibrated",
+    "constant", "model", "measured" and "pyvicbf", see the module
+    docstring.
+    """
+    if protocols is None:
+        protocols = PROTOCOLS
+    else:
+        protocols = [p for p in PROTOCOLS if p.name in protocols]
+    if targets is None:
+        targets = TARGETS
+    print("Reading rounds...")
+    data = read_rounds(rounds, protocols)
+    values = set(val for rows in data.values()
+                 for row in rows.values() for val in row)
+    print("Calculating VICBF parameters...")
+    scheduler = cbfsched.Scheduler(workers)
+    try:
+        params = solve(values, targets, scheduler)
+        measured = dict((t, {}) for t in targets)
+        if sizes == "model":
+            print("Predicting serialized VICBF sizes...")
+            measured = model_sizes(values, targets, params)
+        elif sizes != "constant":
+            measured = calibrated_sizes(values, targets, params)
+        if sizes in ("measured", "pyvicbf"):
+            print("Calculating serialized VICBF sizes...")
+            function = {"measured": vicbfsize.measure,
+                        "pyvicbf": to_vicbf}[sizes]
+            for t, found in measure_sizes(values, targets, params,
+                                          scheduler, function).items():
+                measured[t].update(found)
+    finally:
+        scheduler.close()
+    for p in protocols:
+        for t in targets:
+            path = "vicbf-scaling-fpr{0}-{1}.csv".format(t[0], p.name)
+            print("Writing " + path)
+            write_table(path, p, data[p.name], params[t], measured[t])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Calculate the VI-CBF scaling tables.")
+    parser.add_argument("protocols", nargs="*", metavar="protocol",
+                        help="protocols to calculate, one of " +
+                        ", ".join(p.name for p in PROTOCOLS) +
+                        " (default: all)")
+    parser.add_argument("-f", "--fpr", type=float, action="append",
+                        choices=[t[0] for t in TARGETS],
+                        help="target FPR to calculate (default: all)")
+    parser.add_argument("-r", "--rounds", default="rounds_agg.csv",
+                        help="aggregated rounds file")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: CPUs)")
+    parser.add_argument("-s", "--sizes", default="calibrated",
+                        choices=["calibrated", "constant", "model",
+                                 "measured", "pyvicbf"],
+                        help="how to get the serialized sizes")
+    args = parser.parse_args()
+    for name in args.protocols:
+        if name not in [p.name for p in PROTOCOLS]:
+            parser.error("unknown protocol: " + name)
+    main(args.protocols or None,
+         [t for t in TARGETS if args.fpr is None or t[0] in args.fpr],
+         args.rounds, args.jobs, args.sizes)
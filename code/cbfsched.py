@@ -0,0 +1,78 @@
+"""Run many independent tasks on a pool of persistent worker processes.
+
+The scripts used to do Pool(maxtasksperchild=1) and imap over all values,
+which forks a new process for every single value and consumes the results
+in order, so one slow value holds up everything behind it. The Scheduler
+keeps its workers alive for all tasks, hands them out in batches of roughly
+equal cost, most expensive first, and yields the results as soon as they
+are done, keyed by the task they belong to.
+"""
+
+from multiprocessing import Pool, cpu_count
+
+# Number of batches per worker. More batches balance the load better, fewer
+# batches cause less overhead.
+BATCHES_PER_WORKER = 4
+
+
+def _run_batch(args):
+    """Worker side: run a function over a batch of (key, argument) pairs."""
+    function, batch = args
+    return [(key, function(arg)) for key, arg in batch]
+
+
+def make_batches(tasks, cost, count):
+    """Split {key: argument} into at most count batches of similar cost.
+
+    The tasks are sorted by decreasing cost and dealt out greedily, always
+    to the currently cheapest batch (longest processing time first). The
+    batches are returned most expensive first.
+    """
+    order = sorted(tasks.items(), key=lambda item: cost(item[1]),
+                   reverse=True)
+    count = max(1, min(count, len(order)))
+    batches = [[0.0, []] for _ in range(count)]
+    for key, arg in order:
+        cheapest = min(batches, key=lambda b: b[0])
+        cheapest[0] += cost(arg)
+        cheapest[1].append((key, arg))
+    batches.sort(key=lambda b: b[0], reverse=True)
+    return [b[1] for b in batches if b[1]]
+
+
+class Scheduler(object):
+    """Persistent worker pool with cost-aware, unordered dispatch."""
+
+    def __init__(self, workers=None):
+        self.workers = workers or cpu_count()
+        self.pool = None
+
+    def map(self, function, tasks, cost=None):
+        """Run function on every argument of the dict {key: argument}.
+
+        cost estimates the relative run time of an argument (default: all
+        equal). Yields (key, result) pairs in the order they complete. With
+        a single worker, everything runs in this process.
+        """
+        if cost is None:
+            def cost(arg):
+                return 1.0
+        batches = make_batches(tasks, cost,
+                               self.workers * BATCHES_PER_WORKER)
+        if self.workers == 1:
+            for batch in batches:
+                for item in _run_batch((function, batch)):
+                    yield item
+            return
+        if self.pool is None:
+            self.pool = Pool(self.workers)
+        for done in self.pool.imap_unordered(
+                _run_batch, [(function, batch) for batch in batches]):
+            for item in done:
+                yield item
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
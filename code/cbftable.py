@@ -0,0 +1,130 @@
+"""Precomputed table of optimal VI-CBF parameters.
+
+The table holds the optimal (hash_functions, slots, prob) on a logarithmic
+grid of entry counts from 1 to 10^8 for each target FPR. Any entry count can
+then be answered by interpolating the slots per entry between the two
+neighbouring grid points and refining that estimate with a short local
+search (cbfparams.refine_params), which also verifies the answer with
+calculate_fpr.
+
+Build the table with
+
+    python cbftable.py [output file]
+
+and query it with
+
+    table = ParamTable.load()
+    hash_functions, slots, prob = table.lookup(123456, 0.01, 0.0001)
+"""
+
+import bisect
+import math
+import os
+import sys
+
+import numpy as np
+
+import cbfparams
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "cbfparams-table.txt")
+# (target, deviation) pairs used by the cbfperf scripts
+TARGETS = [(0.1, 0.001), (0.01, 0.0001), (0.001, 0.0001)]
+POINTS_PER_DECADE = 100
+MAX_ENTRIES = 10 ** 8
+
+
+def grid(points_per_decade=POINTS_PER_DECADE, max_entries=MAX_ENTRIES):
+    """Return the sorted, distinct integer entry counts of the table grid."""
+    decades = math.log10(max_entries)
+    points = np.logspace(0, decades, int(decades * points_per_decade) + 1)
+    return [int(x) for x in np.unique(np.round(points))]
+
+
+class ParamTable(object):
+    """Optimal parameters on a grid of entry counts, per target FPR."""
+
+    def __init__(self, rows=None):
+        # (target, deviation, dlbase) => sorted list of
+        # (entries, hash_functions, slots, prob)
+        self.rows = {}
+        for row in rows or []:
+            self.rows.setdefault(tuple(row[:3]), []).append(tuple(row[3:]))
+        for key in self.rows:
+            self.rows[key].sort()
+        self._entries = dict((key, [r[0] for r in value])
+                             for key, value in self.rows.items())
+
+    @classmethod
+    def build(cls, targets=TARGETS, dlbase=4.0,
+              points_per_decade=POINTS_PER_DECADE, max_entries=MAX_ENTRIES):
+        """Solve the whole grid for every (target, deviation) pair."""
+        entries = grid(points_per_decade, max_entries)
+        rows = []
+        for target, deviation in targets:
+            solved = cbfparams.find_params_sequence(entries, target,
+                                                    deviation, dlbase)
+            for value in entries:
+                rows.append((target, deviation, dlbase, float(value)) +
+                            tuple(solved[value]))
+        return cls(rows)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        rows = []
+        with open(path, "r") as fi:
+            for line in fi:
+                if line[0] == '#':
+                    continue
+                rows.append(tuple(float(x) for x in line.split()))
+        return cls(rows)
+
+    def save(self, path=DEFAULT_PATH):
+        with open(path, "w") as fo:
+            fo.write("# target deviation dlbase entries hash_functions "
+                     "slots prob\n")
+            for key in sorted(self.rows):
+                for row in self.rows[key]:
+                    fo.write(" ".join(repr(float(x)) for x in key + row) +
+                             "\n")
+
+    def estimate(self, entries, target=0.01, deviation=0.0001, dlbase=4.0):
+        """Interpolate (hash_functions, slots) from the grid.
+
+        The slots per entry are interpolated linearly in log(entries), the
+        number of hash functions is taken from the closer grid point.
+        """
+        key = (target, deviation, dlbase)
+        if key not in self.rows:
+            raise KeyError("No table for target {0}, deviation {1}, "
+                           "dlbase {2}".format(*key))
+        rows = self.rows[key]
+        entries = float(entries)
+        i = bisect.bisect_left(self._entries[key], entries)
+        if i == 0:
+            return rows[0][1], rows[0][2] * entries / rows[0][0]
+        if i == len(rows):
+            return rows[-1][1], rows[-1][2] * entries / rows[-1][0]
+        lower, upper = rows[i - 1], rows[i]
+        if upper[0] == entries:
+            return upper[1], upper[2]
+        weight = ((math.log(entries) - math.log(lower[0])) /
+                  (math.log(upper[0]) - math.log(lower[0])))
+        ratio = ((1.0 - weight) * lower[2] / lower[0] +
+                 weight * upper[2] / upper[0])
+        hash_functions = lower[1] if weight < 0.5 else upper[1]
+        return hash_functions, ratio * entries
+
+    def lookup(self, entries, target=0.01, deviation=0.0001, dlbase=4.0):
+        """Return the (hash_functions, slots, prob) for any entry count."""
+        hash_functions, slots = self.estimate(entries, target, deviation,
+                                              dlbase)
+        return cbfparams.refine_params(entries, hash_functions, slots, target,
+                                       deviation, dlbase)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH
+    print("Building parameter table...")
+    ParamTable.build().save(path)
+    print("Written to " + path)
@@ -0,0 +1,123 @@
+"""Header-driven, columnar loader for the space-separated data files.
+
+All data files in this repository (rounds_agg.csv, simulation-rounds.csv,
+user-distribution.csv, the vicbf-scaling tables, ...) are space-separated
+tables with a header line naming the columns. load_columns maps those names
+to typed NumPy arrays, so the code can ask for "sharenoretr_median" instead
+of tmp[26]:
+
+    cols = load_columns("rounds_agg.csv", ["round", "sharenoretr_median"],
+                        dtype=np.int64)
+    cols["sharenoretr_median"]  # => array([...])
+
+The whole file is parsed in a single vectorized pass and only the requested
+columns are converted. Columns can also be requested by their 0-based index,
+which is the only way to get at columns the header does not name.
+"""
+
+import numpy as np
+
+
+def _is_number(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+def _split(path):
+    """Return (header names, data lines) of a file.
+
+    The header is the first non-comment line if it does not start with a
+    number. Files without such a line (e.g. "# Entries uncompressed ...")
+    name their columns in the last comment line before the data.
+    """
+    header = []
+    comment = []
+    with open(path, "r") as fi:
+        lines = fi.read().splitlines()
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        if line[0] == '#':
+            comment = line[1:].split()
+            continue
+        tokens = line.split()
+        if not _is_number(tokens[0]):
+            header = tokens
+            data = lines[i + 1:]
+        else:
+            header = comment
+            data = lines[i:]
+        return header, [l for l in data if l.strip() and l[0] != '#']
+    return comment, []
+
+
+def read_header(path):
+    """Return the list of column names of a file."""
+    return _split(path)[0]
+
+
+def load_columns(path, columns=None, dtype=np.float64):
+    """Load the given columns of a file as NumPy arrays.
+
+    columns is a list of header names or 0-based column indexes (default:
+    every named column). dtype is a single NumPy type for all columns or a
+    dict mapping some of the columns to their type (the rest is float64).
+    Text columns (like the test names in vicbf-benchmark.txt) can be loaded
+    with dtype str. Columns by index beyond the longest row are missing in
+    every row. Returns a dict mapping each requested column to its array.
+    """
+    header, lines = _split(path)
+    if columns is None:
+        columns = header
+    index = dict((name, i) for i, name in enumerate(header))
+    try:
+        positions = [c if isinstance(c, int) else index[c] for c in columns]
+    except KeyError as e:
+        raise KeyError("{0} has no column {1}".format(path, e.args[0]))
+    if not lines:
+        return dict((c, np.array([])) for c in columns)
+    rows = [l.split() for l in lines]
+    width = len(rows[0])
+    if all(len(r) == width for r in rows):
+        text = " ".join(lines)
+        if all(_is_number(t) for t in rows[0]):
+            # Purely numeric file: let NumPy parse all of it in C
+            table = np.fromstring(text, dtype=np.float64, sep=" ")
+        else:
+            table = np.array(text.split())
+    else:
+        table = None
+    if table is not None and table.size == width * len(lines):
+        table = table.reshape(-1, width)
+    else:
+        # Rows of different lengths (vicbf-benchmark.txt has several
+        # sections), pad them with missing values row by row.
+        width = max(len(r) for r in rows)
+        table = np.array([r + ["nan"] * (width - len(r)) for r in rows])
+    result = {}
+    for c, pos in zip(columns, positions):
+        if isinstance(dtype, dict):
+            t = dtype.get(c, np.float64)
+        else:
+            t = dtype
+        if pos < table.shape[1]:
+            result[c] = _convert(table[:, pos], t)
+        else:
+            result[c] = _convert(np.array(["nan"] * len(table)), t)
+    return result
+
+
+def _convert(column, t):
+    """Convert a column to type t, treating unparseable values as missing."""
+    if column.dtype.kind not in "US" or np.dtype(t).kind in "US":
+        return column.astype(t)
+    try:
+        # Integers may be written as "5.0", so always go through float
+        column = column.astype(np.float64)
+    except ValueError:
+        column = np.array([float(x) if _is_number(x) else np.nan
+                           for x in column])
+    return column.astype(t)
@@ -0,0 +1,122 @@
+"""Chunked, parallel compression of large serialized VI-CBFs.
+
+The proto1 filters of the u100000 simulation serialize to tens of MB, and a
+single zlib.compress call on such a buffer runs on one core. compress()
+splits the buffer into blocks of BLOCK_SIZE bytes, deflates every block on
+its own on a thread pool (zlib releases the GIL while it works, so the
+threads do run in parallel) and concatenates them behind a small index:
+
+    header  "VICZ", block size, total size, number of blocks
+    index   compressed size and CRC-32 of every block
+    blocks  raw deflate streams, one per block
+
+Because the blocks are independent, decompress() inflates them in parallel
+as well, and decompress_range() only inflates the blocks a slice of the
+serialization needs. Every block costs a few bytes of index and starts
+without any history, so the result is slightly larger than plain zlib.
+"""
+
+import struct
+import zlib
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from vicbfserial import view
+
+MAGIC = b"VICZ"
+# Magic, block size, uncompressed size, number of blocks
+HEADER = struct.Struct(">4sIQI")
+# Compressed size and CRC-32 of the uncompressed block
+ENTRY = struct.Struct(">II")
+BLOCK_SIZE = 1 << 20
+LEVEL = 6
+WBITS = 15
+
+
+def _deflate(args):
+    block, level = args
+    c = zlib.compressobj(level, zlib.DEFLATED, -WBITS)
+    return (c.compress(block) + c.flush(),
+            zlib.crc32(block) & 0xffffffff)
+
+
+def _inflate(args):
+    block, crc = args
+    data = zlib.decompress(block, -WBITS)
+    if zlib.crc32(data) & 0xffffffff != crc:
+        raise ValueError("Block checksum mismatch")
+    return data
+
+
+def _map(function, tasks, workers):
+    """Run function over tasks on a thread pool, in order."""
+    workers = min(workers or cpu_count(), len(tasks))
+    if workers <= 1:
+        return [function(task) for task in tasks]
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(function, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def compress(data, block_size=BLOCK_SIZE, level=LEVEL, workers=None):
+    """Compress data in independent blocks on workers threads.
+
+    workers defaults to one thread per CPU.
+    """
+    blocks = [(view(data, start, min(start + block_size, len(data))),
+               level) for start in range(0, len(data), block_size)]
+    results = _map(_deflate, blocks, workers)
+    return b"".join(
+        [HEADER.pack(MAGIC, block_size, len(data), len(results))] +
+        [ENTRY.pack(len(block), crc) for block, crc in results] +
+        [block for block, _ in results])
+
+
+def read_index(data):
+    """Return (block size, uncompressed size, [(offset, size, crc)]).
+
+    offset and size locate the compressed blocks in data.
+    """
+    magic, block_size, total, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a chunked VI-CBF serialization")
+    offset = HEADER.size + count * ENTRY.size
+    blocks = []
+    for i in range(count):
+        size, crc = ENTRY.unpack_from(data, HEADER.size + i * ENTRY.size)
+        blocks.append((offset, size, crc))
+        offset += size
+    return block_size, total, blocks
+
+
+def decompress_block(data, i):
+    """Return the uncompressed block i of a chunked serialization."""
+    offset, size, crc = read_index(data)[2][i]
+    return _inflate((view(data, offset, offset + size), crc))
+
+
+def decompress_range(data, start, stop, workers=None):
+    """Return bytes start..stop-1 of the uncompressed serialization.
+
+    Only the blocks that overlap the range are decompressed.
+    """
+    block_size, total, blocks = read_index(data)
+    stop = min(stop, total)
+    if start >= stop:
+        return b""
+    first = start // block_size
+    last = (stop - 1) // block_size
+    parts = _map(_inflate, [(view(data, offset, offset + size), crc)
+                            for offset, size, crc in blocks[first:last + 1]],
+                 workers)
+    joined = b"".join(parts)
+    return joined[start - first * block_size:stop - first * block_size]
+
+
+def decompress(data, workers=None):
+    """Decompress a whole chunked serialization on workers threads."""
+    _, total, _ = read_index(data)
+    return decompress_range(data, 0, total, workers)
@@ -0,0 +1,115 @@
+"""Compression codecs for serialized VI-CBFs and a benchmark to compare them.
+
+Everything in this repository compresses with zlib.compress(data, 6). CODECS
+holds the alternatives by name, each as a (compress, decompress) pair of
+functions on byte strings:
+
+* zlib-1 .. zlib-9: zlib at every level
+* deflate-w<bits>-m<mem>: raw deflate (no zlib header and checksum, 6 bytes
+  less) at level 9 with the given window bits and memory level
+* chunked-6: zlib level 6 in independent blocks on a thread pool, see
+  vicbfchunk.py
+* bz2-9: bz2 at level 9
+* lzma-6, lzma-9e: lzma at preset 6 and 9 | extreme (xz container). lzma is
+  part of the standard library from Python 3.3, with Python 2 it needs the
+  backports.lzma package and is left out otherwise.
+
+benchmark() compresses the same data with every codec and measures the
+ratio and the compress and decompress time. ../serialization/generate.py
+runs it on filters of increasing fill (generate.py --benchmark).
+"""
+
+import bz2
+import time
+import zlib
+
+import vicbfchunk
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Number of timed runs per codec, the fastest one is reported
+REPEAT = 3
+
+
+def _zlib(level):
+    def compress(data):
+        return zlib.compress(data, level)
+    return compress, zlib.decompress
+
+
+def _deflate(wbits, memlevel, level=9):
+    def compress(data):
+        c = zlib.compressobj(level, zlib.DEFLATED, -wbits, memlevel)
+        return c.compress(data) + c.flush()
+
+    def decompress(data):
+        return zlib.decompress(data, -wbits)
+    return compress, decompress
+
+
+def _bz2(level):
+    def compress(data):
+        return bz2.compress(data, level)
+    return compress, bz2.decompress
+
+
+def _lzma(preset):
+    def compress(data):
+        return lzma.compress(data, preset=preset)
+    return compress, lzma.decompress
+
+
+CODECS = dict(("zlib-{0}".format(level), _zlib(level))
+              for level in range(1, 10))
+CODECS.update(("deflate-w{0}-m{1}".format(wbits, memlevel),
+               _deflate(wbits, memlevel))
+              for wbits, memlevel in [(15, 9), (15, 8), (12, 9), (9, 9)])
+CODECS["chunked-6"] = (vicbfchunk.compress, vicbfchunk.decompress)
+CODECS["bz2-9"] = _bz2(9)
+if lzma is not None:
+    CODECS["lzma-6"] = _lzma(6)
+    CODECS["lzma-9e"] = _lzma(9 | lzma.PRESET_EXTREME)
+
+
+def codec_names():
+    """Return the names of all codecs, zlib levels first."""
+    return sorted(CODECS, key=lambda name: (not name.startswith("zlib"),
+                                            name))
+
+
+def _timed(function, data, repeat):
+    """Return (result, fastest run time in seconds) of function(data)."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = function(data)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+
+def benchmark(data, names=None, repeat=REPEAT):
+    """Compress data with every codec and check the round trip.
+
+    Returns a list of (codec, compressed size, ratio, compress seconds,
+    decompress seconds), one per codec in names (default: all).
+    """
+    results = []
+    for name in names or codec_names():
+        compress, decompress = CODECS[name]
+        compressed, compress_time = _timed(compress, data, repeat)
+        restored, decompress_time = _timed(decompress, compressed, repeat)
+        if restored != data:
+            raise ValueError("Codec {0} does not restore the data".format(
+                name))
+        results.append((name, len(compressed),
+                        len(compressed) / float(len(data)), compress_time,
+                        decompress_time))
+    return results
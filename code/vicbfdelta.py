@@ -0,0 +1,128 @@
+"""Size of round-to-round VI-CBF updates in the simulation.
+
+The vicbf-scaling tables assume that clients download the whole filter in
+every round. A client that still has the filter of the previous round only
+needs the counters that changed since then, which vicbfserial.py encodes in
+its delta format. This tool replays the entry counts of one series of the
+simulation (see cbfperf.py for the protocols and series) on a single
+filter and prints, for every round, the size of the full download and of the
+delta to the previous round:
+
+    python vicbfdelta.py [-r rounds_agg.csv] [-f FPR] [protocol] [series]
+
+A delta is only possible between filters with the same parameters, so the
+filter is dimensioned once for the largest entry count of the series (at
+the given target FPR) instead of per round. rounds_agg.csv only has the
+number of entries per round, so new entries are inserted as new keys and
+entries that went away are removed oldest first.
+"""
+
+import argparse
+import zlib
+
+import cbfparams
+import cbfperf
+import vicbfserial
+from vicbfsize import BulkVICBF
+
+ZLIB_LEVEL = 6
+
+
+class Replay(object):
+    """A filter whose number of entries follows a series of rounds.
+
+    The filter holds the keys first..last-1.
+    """
+
+    def __init__(self, slots, hash_functions):
+        self.filter = BulkVICBF(slots, hash_functions)
+        self.first = 0
+        self.last = 0
+
+    def resize(self, entries):
+        """Insert or remove keys until the filter holds entries keys."""
+        entries = max(int(entries), 0)
+        if entries > self.last - self.first:
+            stop = self.first + entries
+            self.filter.insert_range(self.last, stop)
+            self.last = stop
+        elif entries < self.last - self.first:
+            start = self.last - entries
+            self.filter.remove_range(self.first, start)
+            self.first = start
+
+
+def sweep(entries, hash_functions, slots, level=ZLIB_LEVEL):
+    """Yield the update sizes for a list of (round, entries).
+
+    Yields (round, entries, full, full compressed, delta, delta compressed,
+    changed counters) per round. full is the serialization a new client
+    downloads (the smaller format, see vicbfserial.serialize), delta the
+    changes since the previous round. The first round has no delta, its
+    delta is the full serialization.
+    """
+    replay = Replay(slots, hash_functions)
+    previous = None
+    for rnd, count in entries:
+        replay.resize(count)
+        counters = replay.filter.counters
+        full = vicbfserial.serialize(counters, hash_functions,
+                                     replay.filter.entries)
+        if previous is None:
+            delta = full
+            changed = int((counters != 0).sum())
+        else:
+            delta = vicbfserial.serialize_delta(previous, counters,
+                                                hash_functions,
+                                                replay.filter.entries)
+            changed = int((counters != previous).sum())
+        yield (rnd, replay.filter.entries, len(full),
+               len(zlib.compress(full, level)), len(delta),
+               len(zlib.compress(delta, level)), changed)
+        previous = counters
+
+
+def main(protocol="proto1", series=None, target=(0.01, 0.0001),
+         rounds="rounds_agg.csv"):
+    """Print the update sizes of one series of a protocol.
+
+    series is the key of a series (see cbfperf.Protocol), by default the
+    first series of the protocol.
+    """
+    proto = [p for p in cbfperf.PROTOCOLS if p.name == protocol][0]
+    names = [key for key, _, _, _ in proto.series]
+    if series is None:
+        series = names[0]
+    if series not in names:
+        raise KeyError("Protocol {0} has no series {1}, only {2}".format(
+            protocol, series, ", ".join(names)))
+    column = names.index(series)
+    data = cbfperf.read_rounds(rounds, [proto])[protocol]
+    entries = [(rnd, data[rnd][column]) for rnd in sorted(data)]
+    largest = max(max(count for _, count in entries), 1)
+    hash_functions, slots, prob = cbfparams.find_params(largest, *target)
+    print("# {0} {1}: {2} hash functions, {3} slots, FPR {4} at {5} "
+          "entries".format(protocol, series, int(hash_functions), int(slots),
+                           prob, largest))
+    print("round entries full full_compressed delta delta_compressed "
+          "changed")
+    for row in sweep(entries, int(hash_functions), int(slots)):
+        print(" ".join(str(x) for x in row))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare full and delta VI-CBF updates per round.")
+    parser.add_argument("protocol", nargs="?", default="proto1",
+                        choices=[p.name for p in cbfperf.PROTOCOLS])
+    parser.add_argument("series", nargs="?", default=None,
+                        help="key of the series, e.g. nvr_max "
+                        "(default: the first)")
+    parser.add_argument("-f", "--fpr", type=float, default=0.01,
+                        choices=[t[0] for t in cbfperf.TARGETS],
+                        help="target FPR (default: 0.01)")
+    parser.add_argument("-r", "--rounds", default="rounds_agg.csv",
+                        help="aggregated rounds file")
+    args = parser.parse_args()
+    main(args.protocol, args.series,
+         [t for t in cbfperf.TARGETS if t[0] == args.fpr][0], args.rounds)
@@ -0,0 +1,141 @@
+"""Preset dictionaries for compressing small serialized VI-CBFs.
+
+A nearly empty filter serializes to a few dozen bytes (19 bytes in the smart
+format), and zlib makes that bigger: the zlib header, checksum and block
+header alone cost more than deflate can save on so little data. A preset
+dictionary (the zdict argument of zlib) gives deflate something to refer to
+from the first byte on. train() builds one from a corpus of serialized
+filters: the substrings that occur most often (headers, common index and
+counter patterns, runs of zeros), most frequent last, so they are closest to
+the data. compress() and decompress() use it with raw deflate, which also
+drops the 6 bytes of zlib framing.
+
+zdict needs Python 3.3 or newer.
+
+    samples = corpus(10000, 3)
+    zdict = train(samples)
+    data = compress(serialized, zdict)
+    assert decompress(data, zdict) == serialized
+
+Train a dictionary for a filter size and compare it to plain zlib with
+
+    python3 vicbfdict.py [-m SLOTS] [-k HASH_FUNCTIONS] [-s SIZE] [-o FILE]
+"""
+
+import argparse
+import collections
+import math
+import zlib
+
+import numpy as np
+
+import vicbfserial
+from vicbfsize import BulkVICBF
+
+# Size of the dictionary in bytes. deflate can only refer back 32 KiB.
+ZDICT_SIZE = 4096
+# Lengths of the substrings counted while training
+SEGMENTS = (3, 4, 6, 8)
+# Fills of the filters in the default training corpus, where the smart
+# format is used and the serializations are small
+FILLS = list(np.linspace(0.0005, 0.05, 40))
+WBITS = 15
+LEVEL = 9
+
+
+def _check():
+    try:
+        zlib.compressobj(LEVEL, zlib.DEFLATED, -WBITS, 9, zdict=b"x")
+    except TypeError:
+        raise RuntimeError("Preset dictionaries need Python 3.3 or newer")
+
+
+def corpus(slots, hash_functions, fills=FILLS, first_key=1 << 32):
+    """Return serializations of filters with the given fills.
+
+    The filters hold keys from first_key on, so that they differ from the
+    filters of the keys 0..n-1 the other tools build.
+    """
+    samples = []
+    for fill in fills:
+        entries = max(1, int(round(-math.log1p(-fill) * slots /
+                                   hash_functions)))
+        v = BulkVICBF(slots, hash_functions)
+        v.insert_range(first_key, first_key + entries)
+        samples.append(vicbfserial.serialize(v.counters, hash_functions,
+                                             entries))
+    return samples
+
+
+def train(samples, size=ZDICT_SIZE, segments=SEGMENTS):
+    """Build a preset dictionary of about size bytes from samples.
+
+    Every substring of the given lengths is scored by how many bytes it
+    could save (occurrences times length beyond a minimal match). The best
+    ones that are not part of an already chosen substring are concatenated,
+    the best one last.
+    """
+    counts = collections.Counter()
+    for sample in samples:
+        for length in segments:
+            for i in range(len(sample) - length + 1):
+                counts[sample[i:i + length]] += 1
+    ranked = sorted(counts.items(),
+                    key=lambda item: (item[1] * (len(item[0]) - 2), item[0]),
+                    reverse=True)
+    chosen = []
+    total = 0
+    for substring, count in ranked:
+        if count < 2 or total >= size:
+            break
+        if any(substring in c for c in chosen):
+            continue
+        chosen.append(substring)
+        total += len(substring)
+    return b"".join(reversed(chosen))
+
+
+def compress(data, zdict, level=LEVEL):
+    """Compress data with raw deflate and a preset dictionary."""
+    _check()
+    c = zlib.compressobj(level, zlib.DEFLATED, -WBITS, 9, zdict=zdict)
+    return c.compress(data) + c.flush()
+
+
+def decompress(data, zdict):
+    """Decompress the output of compress() with the same dictionary."""
+    _check()
+    d = zlib.decompressobj(-WBITS, zdict=zdict)
+    return d.decompress(data) + d.flush()
+
+
+def save(zdict, path):
+    with open(path, "wb") as fo:
+        fo.write(zdict)
+
+
+def load(path):
+    with open(path, "rb") as fi:
+        return fi.read()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train a preset dictionary for serialized VI-CBFs.")
+    parser.add_argument("-m", "--slots", type=int, default=10000)
+    parser.add_argument("-k", "--hash-functions", type=int, default=3)
+    parser.add_argument("-s", "--size", type=int, default=ZDICT_SIZE,
+                        help="dictionary size in bytes")
+    parser.add_argument("-o", "--output", default=None,
+                        help="write the dictionary to this file")
+    args = parser.parse_args()
+    zdict = train(corpus(args.slots, args.hash_functions), args.size)
+    if args.output:
+        save(zdict, args.output)
+    print("# Dictionary of {0} bytes".format(len(zdict)))
+    print("# fill uncompressed zlib dictionary")
+    for fill in [0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3]:
+        sample = corpus(args.slots, args.hash_functions, [fill], 0)[0]
+        print("{0} {1} {2} {3}".format(fill, len(sample),
+                                       len(zlib.compress(sample, 6)),
+                                       len(compress(sample, zdict))))
@@ -0,0 +1,182 @@
+"""Analytic model of the counters and serialized size of a VI-CBF.
+
+Every entry hits hash_functions slots and adds an increment drawn uniformly
+from dlbase..2*dlbase-1 to each of them. The number of hits of a slot is
+Poisson distributed with mean entries * hash_functions / slots, so the
+expected counter histogram follows from the distribution of the sum of j
+increments, weighted with the Poisson probability of j hits (counters
+saturate at 255).
+
+From the histogram the sizes of both serialization formats follow directly:
+"full" stores one byte per slot, "smart" stores an index and a value for
+every non-zero counter. The compressed size is estimated from the entropy of
+the counters: zlib needs factor(fill) * entropy bytes plus a fixed overhead,
+where factor depends on the fraction of non-zero counters and is calibrated
+against the measurements in ../serialization/vicbf-serialization-size-*.txt.
+
+All functions accept NumPy arrays of parameters, so a whole table is
+predicted in one vectorized pass:
+
+    model = CompressionModel.calibrate()
+    sizes = model.predict(entries, hash_functions, slots)
+    sizes["full_compressed"]  # => array([...])
+"""
+
+import math
+import os
+
+import numpy as np
+from scipy.special import gammaln
+
+from columns import load_columns
+from vicbfserial import full_size, smart_size
+
+COUNTER_MAX = 255
+SERIALIZATION = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "serialization")
+FULL_PATH = os.path.join(SERIALIZATION, "vicbf-serialization-size-full.txt")
+SMART_PATH = os.path.join(SERIALIZATION, "vicbf-serialization-size-smart.txt")
+# Parameters of the filters in the calibration files
+CALIBRATION_PARAMS = (10000, 3, 4)
+# Fixed zlib overhead (stream header, checksum, Huffman tables) in bytes and
+# the cost of the long runs of zero counters of the full format per slot
+FULL_OVERHEAD = 40.0
+FULL_OVERHEAD_PER_SLOT = 0.0004
+SMART_OVERHEAD = 20.0
+
+_increment_sums = {}
+
+
+def _sum_distribution(dlbase):
+    """Return the matrix of counter distributions after j hits.
+
+    Row j is the distribution of a counter that was hit j times. Once a
+    counter is hit (COUNTER_MAX + 1) / dlbase times it is saturated, so the
+    last row stands for that many hits or more.
+    """
+    if dlbase not in _increment_sums:
+        hits = int(math.ceil((COUNTER_MAX + 1.0) / dlbase))
+        increment = np.zeros(2 * dlbase)
+        increment[dlbase:] = 1.0 / dlbase
+        rows = np.zeros((hits + 1, COUNTER_MAX + 1))
+        rows[0, 0] = 1.0
+        for j in range(1, hits + 1):
+            row = np.convolve(rows[j - 1], increment)
+            row[COUNTER_MAX] += row[COUNTER_MAX + 1:].sum()
+            rows[j] = row[:COUNTER_MAX + 1]
+        _increment_sums[dlbase] = rows
+    return _increment_sums[dlbase]
+
+
+def counter_distribution(entries, hash_functions, slots, dlbase=4):
+    """Return the probability of each counter value 0..255.
+
+    The parameters can be scalars or arrays of the same shape, the result
+    has one more dimension of length 256.
+    """
+    rows = _sum_distribution(int(dlbase))
+    mean = (np.asarray(entries, dtype=np.float64) *
+            np.asarray(hash_functions, dtype=np.float64) /
+            np.asarray(slots, dtype=np.float64))
+    hits = np.arange(len(rows))
+    # Poisson probabilities of the number of hits, in log space so that
+    # large means do not underflow
+    mean = np.maximum(mean, np.finfo(np.float64).tiny)[..., np.newaxis]
+    weights = np.exp(hits * np.log(mean) - mean - gammaln(hits + 1))
+    # Everything from the last row on is saturated
+    weights[..., -1] = np.maximum(1.0 - weights[..., :-1].sum(axis=-1), 0.0)
+    return np.dot(weights, rows)
+
+
+def expected_histogram(entries, hash_functions, slots, dlbase=4):
+    """Return the expected number of counters with each value 0..255."""
+    return (np.asarray(slots, dtype=np.float64)[..., np.newaxis] *
+            counter_distribution(entries, hash_functions, slots, dlbase))
+
+
+def entropy(distribution):
+    """Return the entropy in bits of the distribution(s) in the last axis."""
+    p = np.asarray(distribution, dtype=np.float64)
+    logs = np.log2(np.where(p > 0, p, 1.0))
+    return -(p * logs).sum(axis=-1)
+
+
+def _statistics(entries, hash_functions, slots, dlbase):
+    """Return (fill, entropy bytes) of the counters of the filters."""
+    distribution = counter_distribution(entries, hash_functions, slots,
+                                        dlbase)
+    fill = 1.0 - distribution[..., 0]
+    return fill, np.asarray(slots) * entropy(distribution) / 8.0
+
+
+class CompressionModel(object):
+    """Entropy bound of the compressed size, calibrated per format.
+
+    full and smart are (fill, factor) arrays sorted by fill: a filter whose
+    counters have the entropy E (in bytes) compresses to factor(fill) * E
+    plus the fixed overhead of the format.
+    """
+
+    def __init__(self, full, smart):
+        self.full = full
+        self.smart = smart
+
+    @classmethod
+    def calibrate(cls, full_path=FULL_PATH, smart_path=SMART_PATH,
+                  params=CALIBRATION_PARAMS):
+        """Derive the factors from the serialization size measurements.
+
+        The files list one filter per line, created with params (slots,
+        hash_functions, dlbase) and holding Entries + 1 entries. Lines in
+        which the smart serialization fell back to the full one are skipped
+        for the smart format.
+        """
+        slots, hash_functions, dlbase = params
+        tables = []
+        for path, smart in [(full_path, False), (smart_path, True)]:
+            cols = load_columns(path, ["Entries", "uncompressed",
+                                       "compressed"])
+            keep = cols["uncompressed"] < full_size(slots) if smart else \
+                np.ones(len(cols["Entries"]), dtype=bool)
+            fill, size = _statistics(cols["Entries"][keep] + 1,
+                                     hash_functions, slots, dlbase)
+            overhead = cls.overhead(slots, smart)
+            factor = (cols["compressed"][keep] - overhead) / size
+            order = np.argsort(fill, kind="mergesort")
+            tables.append((fill[order], factor[order]))
+        return cls(*tables)
+
+    @staticmethod
+    def overhead(slots, smart=False):
+        """Return the fixed part of the compressed size of a format."""
+        if smart:
+            return SMART_OVERHEAD
+        return FULL_OVERHEAD + FULL_OVERHEAD_PER_SLOT * np.asarray(slots)
+
+    def predict(self, entries, hash_functions, slots, dlbase=4):
+        """Predict the serialized sizes of filters in bytes.
+
+        Returns a dict of float arrays: "full" and "smart" are the
+        uncompressed sizes of both formats, "chosen" the smaller one of the
+        two (like the smart serialization, which falls back to the full
+        format), and "full_compressed", "smart_compressed" and
+        "chosen_compressed" the estimated sizes after zlib compression.
+        """
+        slots = np.asarray(slots, dtype=np.float64)
+        fill, size = _statistics(entries, hash_functions, slots, dlbase)
+        full = full_size(slots)
+        smart = smart_size(fill * slots, slots)
+        full_compressed = (self.overhead(slots) +
+                           np.interp(fill, *self.full) * size)
+        smart_compressed = (self.overhead(slots, True) +
+                            np.interp(fill, *self.smart) * size)
+        use_smart = smart < full
+        return {
+            "full": full,
+            "smart": smart,
+            "chosen": np.where(use_smart, smart, full),
+            "full_compressed": full_compressed,
+            "smart_compressed": smart_compressed,
+            "chosen_compressed": np.where(use_smart, smart_compressed,
+                                          full_compressed),
+        }
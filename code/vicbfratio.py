@@ -0,0 +1,142 @@
+"""Calibration table of the compression ratio of serialized VI-CBFs.
+
+How well the full serialization compresses depends almost only on how many
+counters are set: an empty filter is mostly runs of zeros, a full one is
+close to random bytes. vicbf-serialization-size-full.txt shows the ratio
+going from below 1% to over 60% as the filter fills. This module samples
+real serializations on a grid of fill ratios (the fraction of non-zero
+counters), hash functions and zlib levels and stores the ratios in a small
+table, from which the ratio of any filter is interpolated.
+
+Build the table (on a cbfsched.Scheduler, one worker per CPU) with
+
+    python vicbfratio.py [output file]
+
+and query it with
+
+    table = RatioTable.load()
+    compressed = table.ratio(fill(entries, hash_functions, slots),
+                             hash_functions) * (slots + 10)
+"""
+
+import bisect
+import math
+import os
+import sys
+import zlib
+
+import cbfsched
+import vicbfsize
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "vicbf-ratio-table.txt")
+# Slots of the sampled filters. Large enough that the fixed zlib overhead
+# does not matter, small enough to build the whole grid in a few minutes.
+SAMPLE_SLOTS = 100000
+FILLS = [0.0, 0.001, 0.002, 0.005, 0.01, 0.02, 0.03, 0.05, 0.07, 0.1, 0.15,
+         0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.75,
+         0.8, 0.85, 0.9, 0.95, 0.98, 0.99, 0.999]
+HASH_FUNCTIONS = list(range(1, 13))
+LEVELS = list(range(1, 10))
+
+
+def fill(entries, hash_functions, slots):
+    """Return the expected fraction of non-zero counters of a filter."""
+    return -math.expm1(-float(entries) * hash_functions / slots)
+
+
+def entries_for_fill(fill_ratio, hash_functions, slots):
+    """Return the number of entries that fill a filter to fill_ratio."""
+    return int(round(-math.log1p(-fill_ratio) * slots / hash_functions))
+
+
+def sample(args):
+    """Build a filter with the given fill and measure it at all levels.
+
+    args is (fill ratio, hash functions, slots, levels). Returns the list of
+    compression ratios, one per level.
+    """
+    fill_ratio, hash_functions, slots, levels = args
+    entries = entries_for_fill(fill_ratio, hash_functions, slots)
+    counters = vicbfsize.build_counters(entries, hash_functions, slots)
+    serialized = vicbfsize.serialize_full(counters, hash_functions, entries)
+    return [len(zlib.compress(serialized, level)) / float(len(serialized))
+            for level in levels]
+
+
+class RatioTable(object):
+    """Compression ratios on a grid of fill ratios, per k and zlib level."""
+
+    def __init__(self, rows=None):
+        # (hash_functions, level) => sorted list of (fill, ratio)
+        self.rows = {}
+        for row in rows or []:
+            self.rows.setdefault((int(row[1]), int(row[2])), []).append(
+                (row[0], row[3]))
+        for key in self.rows:
+            self.rows[key].sort()
+        self._fills = dict((key, [r[0] for r in value])
+                           for key, value in self.rows.items())
+
+    @classmethod
+    def build(cls, fills=FILLS, hash_functions=HASH_FUNCTIONS, levels=LEVELS,
+              slots=SAMPLE_SLOTS, workers=None):
+        """Sample the whole grid on a pool of worker processes."""
+        tasks = dict(((f, k), (f, k, slots, levels))
+                     for f in fills for k in hash_functions)
+        scheduler = cbfsched.Scheduler(workers)
+        rows = []
+        try:
+            for (f, k), ratios in scheduler.map(
+                    sample, tasks, lambda args: args[0] + 0.1):
+                rows.extend((f, k, level, ratio)
+                            for level, ratio in zip(levels, ratios))
+        finally:
+            scheduler.close()
+        return cls(rows)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        rows = []
+        with open(path, "r") as fi:
+            for line in fi:
+                if line[0] == '#':
+                    continue
+                rows.append(tuple(float(x) for x in line.split()))
+        return cls(rows)
+
+    def save(self, path=DEFAULT_PATH):
+        with open(path, "w") as fo:
+            fo.write("# fill hash_functions level ratio\n")
+            for key in sorted(self.rows):
+                for f, ratio in self.rows[key]:
+                    fo.write("{0!r} {1} {2} {3:.6f}\n".format(
+                        float(f), key[0], key[1], ratio))
+
+    def ratio(self, fill_ratio, hash_functions, level=vicbfsize.ZLIB_LEVEL):
+        """Interpolate the compression ratio of a filter.
+
+        The ratio is interpolated linearly in the fill ratio. Filters with
+        more hash functions than the table has use the largest one.
+        """
+        ks = sorted(set(key[0] for key in self.rows if key[1] == level))
+        if not ks:
+            raise KeyError("No table for zlib level {0}".format(level))
+        k = ks[min(bisect.bisect_left(ks, int(hash_functions)), len(ks) - 1)]
+        fills = self._fills[(k, level)]
+        rows = self.rows[(k, level)]
+        i = bisect.bisect_left(fills, fill_ratio)
+        if i == 0:
+            return rows[0][1]
+        if i == len(rows):
+            return rows[-1][1]
+        lower, upper = rows[i - 1], rows[i]
+        weight = (fill_ratio - lower[0]) / (upper[0] - lower[0])
+        return (1.0 - weight) * lower[1] + weight * upper[1]
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH
+    print("Sampling compression ratios...")
+    RatioTable.build().save(path)
+    print("Written to " + path)
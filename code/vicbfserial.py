@@ -0,0 +1,316 @@
+"""Serialization formats of VI-CBFs and automatic selection between them.
+
+Every serialization starts with a 10 byte header: the format, the number of
+hash functions, slots and entries. Three formats follow it:
+
+* FULL stores one byte per counter, like pyVICBF does today.
+* SMART stores an index (index_bytes(slots) bytes, big endian) and the value
+  of every non-zero counter, like pyVICBF up to commit 3eebf08.
+* DELTA stores index and new value of every counter that changed since a
+  previous version of the same filter, so a client that has that version
+  only downloads the changes (serialize_delta and apply_delta).
+
+Smart is smaller for sparse filters, full for filled ones. Uncompressed,
+smart wins as long as the (index_bytes + 1) bytes per non-zero counter are
+fewer than the slots, i.e. below a fill of 1 / (index_bytes + 1). After zlib
+compression the long runs of zeros of a sparse full serialization are cheap,
+so the crossover is at a much lower fill; CROSSOVER holds those fills, as
+measured by measure_crossover(), for filters of 2^8 to 2^24 slots.
+
+serialize() picks the smaller format from the fill alone and records the
+choice in the format byte, deserialize() reads both:
+
+    data = serialize(counters, hash_functions, entries)
+    hash_functions, entries, counters = deserialize(data)
+
+serialize_into() writes a serialization straight into a writable buffer
+(a bytearray, a NumPy array or an mmap, see MappedFile) instead of building
+new byte strings, and returns a view of the written bytes (a memoryview, a
+buffer on Python 2) that zlib and hashlib take as they are:
+
+    buf = bytearray(full_size(len(counters)))
+    data = serialize_into(buf, counters, hash_functions, entries, kind=FULL)
+    zlib.compress(data)
+
+Run "python vicbfserial.py" to measure the crossover table again.
+"""
+
+import bisect
+import math
+import mmap
+import struct
+import zlib
+
+import numpy as np
+
+# Header: format, hash functions, slots, entries
+HEADER = struct.Struct(">BBII")
+FULL = 0
+SMART = 1
+DELTA = 2
+ZLIB_LEVEL = 6
+
+# (slots, fill) pairs: below the fill, the compressed smart serialization is
+# smaller than the compressed full one. Measured with measure_crossover().
+CROSSOVER = [
+    (256, 0.1054),
+    (1024, 0.0246),
+    (4096, 0.0185),
+    (16384, 0.0083),
+    (65536, 0.0084),
+    (262144, 0.0034),
+    (1048576, 0.0026),
+    (4194304, 0.0020),
+    (16777216, 0.0018),
+]
+
+
+try:
+    buffer
+except NameError:
+    def view(data, start, stop):
+        """Return a view of data[start:stop] without copying."""
+        return memoryview(data)[start:stop]
+else:
+    # zlib and hashlib of Python 2 do not accept memoryviews
+    def view(data, start, stop):
+        """Return a view of data[start:stop] without copying."""
+        return buffer(data, start, stop - start)
+
+
+def index_bytes(slots):
+    """Return the number of bytes of a slot index in the smart format.
+
+    slots may also be an array of filter sizes, see smart_size.
+    """
+    if np.ndim(slots):
+        return np.vectorize(index_bytes, otypes=[np.int64])(slots)
+    return max(1, (int(slots - 1).bit_length() + 7) // 8)
+
+
+def full_size(slots):
+    """Return the size of the full serialization of a filter."""
+    return HEADER.size + slots
+
+
+def smart_size(nonzero, slots):
+    """Return the size of the smart serialization of a filter.
+
+    Also takes arrays, and expected (fractional) numbers of non-zero
+    counters like vicbfmodel.py predicts them.
+    """
+    return HEADER.size + (index_bytes(slots) + 1) * nonzero
+
+
+def delta_size(changed, slots):
+    """Return the size of a delta serialization of a filter."""
+    return smart_size(changed, slots)
+
+
+def crossover(slots):
+    """Return the fill below which smart compresses better than full.
+
+    Interpolated linearly in log(slots) between the rows of CROSSOVER.
+    """
+    sizes = [row[0] for row in CROSSOVER]
+    i = bisect.bisect_left(sizes, slots)
+    if i == 0:
+        return CROSSOVER[0][1]
+    if i == len(CROSSOVER):
+        return CROSSOVER[-1][1]
+    lower, upper = CROSSOVER[i - 1], CROSSOVER[i]
+    weight = ((math.log(slots) - math.log(lower[0])) /
+              (math.log(upper[0]) - math.log(lower[0])))
+    return (1.0 - weight) * lower[1] + weight * upper[1]
+
+
+def choose(nonzero, slots, compressed=True):
+    """Return the smaller format (FULL or SMART) for a filter.
+
+    With compressed, the format that is smaller after zlib compression is
+    estimated from the fill, otherwise the uncompressed sizes are compared
+    exactly, like the smart serialization of pyVICBF did.
+    """
+    if compressed:
+        return SMART if nonzero < crossover(slots) * slots else FULL
+    return SMART if smart_size(nonzero, slots) < full_size(slots) else FULL
+
+
+def serialize_full(counters, hash_functions, entries):
+    """Serialize a counter array in the full format."""
+    return (HEADER.pack(FULL, int(hash_functions), len(counters),
+                        int(entries)) + counters.tobytes())
+
+
+def _encode_indexed(idx, values, slots):
+    """Return the (index, value) records of the smart and delta formats."""
+    width = index_bytes(slots)
+    body = np.empty((len(idx), width + 1), dtype=np.uint8)
+    body[:, :width] = idx.astype(">u8").view(np.uint8).reshape(-1, 8)[
+        :, 8 - width:]
+    body[:, width] = values
+    return body.tobytes()
+
+
+def _decode_indexed(body, slots):
+    """Return the (indexes, values) arrays of (index, value) records."""
+    width = index_bytes(slots)
+    body = body.reshape(-1, width + 1)
+    padded = np.zeros((len(body), 8), dtype=np.uint8)
+    padded[:, 8 - width:] = body[:, :width]
+    return padded.view(">u8").ravel(), body[:, width]
+
+
+def serialize_smart(counters, hash_functions, entries):
+    """Serialize a counter array in the smart format."""
+    idx = np.flatnonzero(counters)
+    return (HEADER.pack(SMART, int(hash_functions), len(counters),
+                        int(entries)) +
+            _encode_indexed(idx, counters[idx], len(counters)))
+
+
+def serialize_delta(old, new, hash_functions, entries):
+    """Serialize the changes from the counter array old to new.
+
+    Both arrays must belong to filters with the same slots and hash
+    functions. entries is the number of entries of the new filter.
+    """
+    if len(old) != len(new):
+        raise ValueError("Cannot encode a delta between filters of {0} "
+                         "and {1} slots".format(len(old), len(new)))
+    idx = np.flatnonzero(old != new)
+    return (HEADER.pack(DELTA, int(hash_functions), len(new), int(entries)) +
+            _encode_indexed(idx, new[idx], len(new)))
+
+
+def serialize(counters, hash_functions, entries, compressed=True):
+    """Serialize a counter array in the smaller of both formats."""
+    if choose(np.count_nonzero(counters), len(counters), compressed) == SMART:
+        return serialize_smart(counters, hash_functions, entries)
+    return serialize_full(counters, hash_functions, entries)
+
+
+def serialize_into(buf, counters, hash_functions, entries, offset=0,
+                   kind=None):
+    """Serialize a counter array into the writable buffer buf at offset.
+
+    kind is FULL or SMART, by default the one serialize() would pick. buf
+    must have room for the serialization (see full_size and smart_size).
+    Returns a view of the written bytes, see view().
+    """
+    nonzero = np.count_nonzero(counters)
+    if kind is None:
+        kind = choose(nonzero, len(counters))
+    if kind == FULL:
+        size = full_size(len(counters))
+    elif kind == SMART:
+        size = smart_size(nonzero, len(counters))
+    else:
+        raise ValueError("Cannot serialize into format {0}".format(kind))
+    out = np.frombuffer(buf, dtype=np.uint8, count=size, offset=offset)
+    HEADER.pack_into(buf, offset, kind, int(hash_functions), len(counters),
+                     int(entries))
+    body = out[HEADER.size:]
+    if kind == FULL:
+        body[:] = counters
+    else:
+        width = index_bytes(len(counters))
+        idx = np.flatnonzero(counters)
+        records = body.reshape(-1, width + 1)
+        records[:, :width] = idx.astype(">u8").view(np.uint8).reshape(
+            -1, 8)[:, 8 - width:]
+        records[:, width] = counters[idx]
+    return view(buf, offset, offset + size)
+
+
+class MappedFile(object):
+    """A new file of a fixed size, mapped into memory.
+
+    Serialize into it with serialize_into(f.map, ...). Views of the map
+    must be released before the file is closed.
+    """
+
+    def __init__(self, path, size):
+        self._file = open(path, "w+b")
+        self._file.truncate(size)
+        self.map = mmap.mmap(self._file.fileno(), size)
+
+    def close(self):
+        self.map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def deserialize(data):
+    """Return (hash_functions, entries, counters) of a serialization."""
+    kind, hash_functions, slots, entries = HEADER.unpack_from(data)
+    body = np.frombuffer(data, dtype=np.uint8, offset=HEADER.size)
+    if kind == FULL:
+        return hash_functions, entries, body.copy()
+    if kind == DELTA:
+        raise ValueError("A delta needs the previous counters, use "
+                         "apply_delta")
+    if kind != SMART:
+        raise ValueError("Unknown serialization format {0}".format(kind))
+    counters = np.zeros(slots, dtype=np.uint8)
+    idx, values = _decode_indexed(body, slots)
+    counters[idx] = values
+    return hash_functions, entries, counters
+
+
+def apply_delta(counters, data):
+    """Apply a delta serialization to the previous counter array.
+
+    Returns (hash_functions, entries, counters) of the new filter, the
+    previous counters are left unchanged.
+    """
+    kind, hash_functions, slots, entries = HEADER.unpack_from(data)
+    if kind != DELTA:
+        raise ValueError("Not a delta serialization: format {0}".format(kind))
+    if slots != len(counters):
+        raise ValueError("Delta for {0} slots applied to a filter of {1} "
+                         "slots".format(slots, len(counters)))
+    counters = counters.copy()
+    idx, values = _decode_indexed(
+        np.frombuffer(data, dtype=np.uint8, offset=HEADER.size), slots)
+    counters[idx] = values
+    return hash_functions, entries, counters
+
+
+def measure_crossover(slots, hash_functions=3, level=ZLIB_LEVEL, steps=16):
+    """Find the fill at which both formats compress to the same size.
+
+    Bisects the fill between 0 and the uncompressed crossover with filters
+    built by vicbfsize.BulkVICBF.
+    """
+    from vicbfsize import BulkVICBF
+    lo, hi = 0.0, 1.0 / (index_bytes(slots) + 1)
+    for _ in range(steps):
+        mid = (lo + hi) / 2.0
+        entries = max(1, int(round(-math.log1p(-mid) * slots /
+                                   hash_functions)))
+        v = BulkVICBF(slots, hash_functions)
+        v.insert_range(0, entries)
+        counters = v.counters
+        full = zlib.compress(serialize_full(counters, hash_functions,
+                                            entries), level)
+        smart = zlib.compress(serialize_smart(counters, hash_functions,
+                                              entries), level)
+        if len(smart) < len(full):
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2.0
+
+
+if __name__ == "__main__":
+    print("CROSSOVER = [")
+    for exponent in range(8, 25, 2):
+        print("    ({0}, {1:.4f}),".format(2 ** exponent,
+                                            measure_crossover(2 ** exponent)))
+    print("]")
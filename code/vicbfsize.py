@@ -0,0 +1,185 @@
+"""Measure the serialized and compressed size of VI-CBFs.
+
+Building a VI-CBF with pyVICBF means one v.insert(k) per entry, which is far
+too slow for filters with millions of entries. BulkVICBF keeps the counters
+of a VI-CBF in a NumPy array and inserts whole ranges or arrays of keys at
+once instead: the hashes of a block of keys are calculated together and the
+variable increments are scatter-added into the counters. The result is
+serialized in the full format of vicbfserial.py (its own 10 byte header
+followed by one byte per counter, as large as the full serialization of
+pyVICBF but not byte compatible with it) and compressed with zlib:
+
+    v = BulkVICBF(slots, hash_functions)
+    v.insert_range(0, 5000000)
+    v.insert_many(np.array([12, 34, 56]))
+    serialized = v.serialize()
+
+measure() is meant to be run on a cbfsched.Scheduler, see cbfperf.py.
+"""
+
+import zlib
+
+import numpy as np
+
+from vicbfserial import FULL, HEADER, full_size, serialize_full, view
+
+# Largest number of entries the cbfperf engine builds real filters for
+MEASURE_LIMIT = 11000000
+# Number of keys hashed at once, bounds the memory used while building
+BLOCK = 1 << 20
+# Largest filter that is updated with np.bincount, which needs a temporary
+# float64 array of all slots per block. Larger ones use np.add.at.
+BINCOUNT_SLOTS = 1 << 24
+# np.bincount costs time per slot, np.add.at about this many times as much
+# per increment, so blocks of fewer than slots / ADD_AT_RATIO increments
+# (like the few keys generate.py inserts per step) use np.add.at
+ADD_AT_RATIO = 32
+# Counters are a single byte and saturate
+COUNTER_MAX = 255
+ZLIB_LEVEL = 6
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix(x):
+    """splitmix64 finalizer on an array of uint64 (wraps around)."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * _MIX1
+    x = x ^ (x >> np.uint64(27))
+    x = x * _MIX2
+    return x ^ (x >> np.uint64(31))
+
+
+class BulkVICBF(object):
+    """Array-backed VI-CBF that inserts many keys at once.
+
+    Keys are non-negative integers. Every key and hash function selects a
+    slot and an increment from dlbase..2*dlbase-1. The counters are summed
+    in 32 bits and saturated at 255 when they are read.
+    """
+
+    def __init__(self, slots, hash_functions, dlbase=4):
+        self.slots = int(slots)
+        self.hash_functions = int(hash_functions)
+        self.dlbase = int(dlbase)
+        self.entries = 0
+        self._sums = np.zeros(self.slots, dtype=np.uint32)
+        self._salts = (np.arange(1, self.hash_functions + 1, dtype=np.uint64) *
+                       _GOLDEN)
+
+    def positions(self, keys):
+        """Return the (slots, increments) arrays of an array of keys."""
+        keys = np.asarray(keys).astype(np.uint64)
+        h = _mix(keys[:, np.newaxis] ^ self._salts[np.newaxis, :]).ravel()
+        idx = (h % np.uint64(self.slots)).astype(np.intp)
+        inc = (self.dlbase +
+               (h >> np.uint64(32)) % np.uint64(self.dlbase)).astype(np.uint32)
+        return idx, inc
+
+    def insert_many(self, keys):
+        """Insert an array of keys, BLOCK keys at a time."""
+        keys = np.asarray(keys)
+        for start in range(0, len(keys), BLOCK):
+            self._insert_block(keys[start:start + BLOCK])
+
+    def insert_range(self, start, stop):
+        """Insert the keys start..stop-1."""
+        for first in range(int(start), int(stop), BLOCK):
+            self._insert_block(np.arange(first, min(first + BLOCK, int(stop)),
+                                         dtype=np.uint64))
+
+    def remove_range(self, start, stop):
+        """Remove the keys start..stop-1, which must have been inserted.
+
+        Unlike the counters of pyVICBF, the sums behind the counters do not
+        stick at 255, so removing keys from a saturated slot is exact.
+        """
+        for first in range(int(start), int(stop), BLOCK):
+            keys = np.arange(first, min(first + BLOCK, int(stop)),
+                             dtype=np.uint64)
+            idx, inc = self.positions(keys)
+            self.add(idx, inc, -1)
+            self.entries -= len(keys)
+
+    def _insert_block(self, keys):
+        self.add(*self.positions(keys))
+        self.entries += len(keys)
+
+    def add(self, idx, inc, sign=1):
+        """Scatter-add the increments inc to the slots idx.
+
+        This is the second half of inserting keys, for callers that need
+        the positions themselves (see ../serialization/generate.py). It
+        does not count the entries. With sign -1, the increments are
+        subtracted instead.
+        """
+        if (self.slots <= BINCOUNT_SLOTS and
+                len(idx) * ADD_AT_RATIO >= self.slots):
+            sums = np.bincount(idx, weights=inc,
+                               minlength=self.slots).astype(np.uint32)
+            if sign < 0:
+                self._sums -= sums
+            else:
+                self._sums += sums
+        elif sign < 0:
+            np.subtract.at(self._sums, idx, inc)
+        else:
+            np.add.at(self._sums, idx, inc)
+
+    def get(self, idx):
+        """Return the saturated counters of the slots idx as uint8."""
+        return np.minimum(self._sums[idx], COUNTER_MAX).astype(np.uint8)
+
+    @property
+    def counters(self):
+        """The counter array as uint8, saturated at 255."""
+        return np.minimum(self._sums, COUNTER_MAX).astype(np.uint8)
+
+    def counters_into(self, out):
+        """Write the saturated counters into the uint8 array out."""
+        np.minimum(self._sums, COUNTER_MAX, out=out, casting="unsafe")
+
+    def serialize(self):
+        """Serialize the filter in the full format."""
+        return serialize_full(self.counters, self.hash_functions,
+                              self.entries)
+
+    def serialize_into(self, buf, offset=0):
+        """Serialize the filter in the full format into a writable buffer.
+
+        Unlike serialize(), this makes no copies of the counters: they are
+        saturated straight into buf. Returns a view of the written bytes,
+        see vicbfserial.serialize_into.
+        """
+        size = full_size(self.slots)
+        out = np.frombuffer(buf, dtype=np.uint8, count=size, offset=offset)
+        HEADER.pack_into(buf, offset, FULL, self.hash_functions, self.slots,
+                         self.entries)
+        self.counters_into(out[HEADER.size:])
+        return view(buf, offset, offset + size)
+
+
+def build_counters(entries, hash_functions, slots, dlbase=4):
+    """Return the counter array of a VI-CBF holding the keys 0..entries-1."""
+    v = BulkVICBF(slots, hash_functions, dlbase)
+    v.insert_range(0, entries)
+    return v.counters
+
+
+def measure(params):
+    """Build a filter for (entries, hash_functions, slots) and measure it.
+
+    Returns the (uncompressed, compressed) size in bytes.
+    """
+    entries, hash_functions, slots = [int(float(x)) for x in params]
+    v = BulkVICBF(slots, hash_functions)
+    v.insert_range(0, entries)
+    serialized = v.serialize_into(bytearray(full_size(slots)))
+    return len(serialized), len(zlib.compress(serialized, ZLIB_LEVEL))
+
+
+def measure_cost(params):
+    """Relative cost of measure(), dominated by hashing the entries."""
+    return float(params[0]) * float(params[1]) + float(params[2])
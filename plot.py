@@ -1,12 +1,54 @@
-"""Python script to create GnuPlot plots."""
+"""Python script to create GnuPlot plots.
 
+Usage: python plot.py [-j JOBS] [-f] [-s] [output ...]
+
+Renders every figure in TARGET (or only the given outputs) into output/,
+running one gnuplot per CPU in parallel (-j sets the number). Like make,
+only figures whose gnuplot script or input files changed since they were
+last rendered are rendered again; -f renders all of them. With -s, every
+job keeps one gnuplot session running for all its figures instead of
+starting a new gnuplot per figure.
+
+Plots with a "filter" only show the rows of their input whose columns have
+the given values. plot.py reads every input file once, selects the rows
+itself and hands them to gnuplot as inline data blocks, which needs
+gnuplot 5 or newer. With NumPy installed, plot.py also evaluates the x and
+y columns of the plots (column numbers and arithmetic on $N columns, like
+"($21 / 1024 / 1024)") on the inputs as loaded by code/columns.py, and
+only passes the resulting columns to gnuplot.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
 from subprocess import Popen, PIPE
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "code"))
+try:
+    import numpy as np
+    from columns import load_columns
+except ImportError:
+    np = None  # gnuplot evaluates the x and y columns itself
+
 # A few constants shared across all plots
 FONTSIZE = "15"
 TERMINAL = "postscript eps color solid"
 LINEWIDTH = "3"
 OUTPUT_PREFIX = "output/"
+GNUPLOT = "/usr/bin/gnuplot"
+# Hashes of the figures in output/ when they were rendered, see target_hash
+CACHE = OUTPUT_PREFIX + ".plotcache.json"
+# SHA-1 of the input files by path, see file_hash
+DIGESTS = {}
+DIGESTS_LOCK = threading.Lock()
 # The following is the template all GnuPlot script files share. It contains
 # placeholders for a number of values:
 # 0. Terminal type (filled from variable TERMINAL)
@@ -1425,7 +1467,12 @@ TARGET = [
         "plot":
             [
                 {
-                    "input": "< awk '$1 ~ /^insert$/ && $2 ~ /^2$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "insert"},
+                            {"column": "2", "value": "2"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=2",
@@ -1436,7 +1483,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^insert$/ && $2 ~ /^3$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "insert"},
+                            {"column": "2", "value": "3"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=3",
@@ -1447,7 +1499,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^insert$/ && $2 ~ /^4$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "insert"},
+                            {"column": "2", "value": "4"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=4",
@@ -1458,7 +1515,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^insert$/ && $2 ~ /^5$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "insert"},
+                            {"column": "2", "value": "5"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=5",
@@ -1484,7 +1546,12 @@ TARGET = [
         "plot":
             [
                 {
-                    "input": "< awk '$1 ~ /^queryp$/ && $2 ~ /^2$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "queryp"},
+                            {"column": "2", "value": "2"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=2",
@@ -1495,7 +1562,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^queryp$/ && $2 ~ /^3$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "queryp"},
+                            {"column": "2", "value": "3"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=3",
@@ -1506,7 +1578,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^queryp$/ && $2 ~ /^4$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "queryp"},
+                            {"column": "2", "value": "4"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=4",
@@ -1517,7 +1594,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^queryp$/ && $2 ~ /^5$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "queryp"},
+                            {"column": "2", "value": "5"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=5",
@@ -1542,7 +1624,12 @@ TARGET = [
         "plot":
             [
                 {
-                    "input": "< awk '$1 ~ /^queryn$/ && $2 ~ /^2$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "queryn"},
+                            {"column": "2", "value": "2"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=2",
@@ -1553,7 +1640,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^queryn$/ && $2 ~ /^3$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "queryn"},
+                            {"column": "2", "value": "3"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=3",
@@ -1564,7 +1656,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^queryn$/ && $2 ~ /^4$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "queryn"},
+                            {"column": "2", "value": "4"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=4",
@@ -1575,7 +1672,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^queryn$/ && $2 ~ /^5$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "queryn"},
+                            {"column": "2", "value": "5"}
+                        ],
                     "x": "3",
                     "y": "($4 / 1000000)",
                     "title": "k=5",
@@ -1601,7 +1703,12 @@ TARGET = [
         "plot":
             [
                 {
-                    "input": "< awk '$1 ~ /^serialize$/ && $2 ~ /^2$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "serialize"},
+                            {"column": "2", "value": "2"}
+                        ],
                     "x": "3",
                     "y": "($4)",
                     "title": "k=2",
@@ -1612,7 +1719,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^serialize$/ && $2 ~ /^3$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "serialize"},
+                            {"column": "2", "value": "3"}
+                        ],
                     "x": "3",
                     "y": "($4)",
                     "title": "k=3",
@@ -1623,7 +1735,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^serialize$/ && $2 ~ /^4$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "serialize"},
+                            {"column": "2", "value": "4"}
+                        ],
                     "x": "3",
                     "y": "($4)",
                     "title": "k=4",
@@ -1634,7 +1751,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^serialize$/ && $2 ~ /^5$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "serialize"},
+                            {"column": "2", "value": "5"}
+                        ],
                     "x": "3",
                     "y": "($4)",
                     "title": "k=5",
@@ -1660,7 +1782,12 @@ TARGET = [
         "plot":
             [
                 {
-                    "input": "< awk '$1 ~ /^serialize$/ && $2 ~ /^2$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "serialize"},
+                            {"column": "2", "value": "2"}
+                        ],
                     "x": "3",
                     "y": "($9 - $4)",
                     "title": "k=2",
@@ -1671,7 +1798,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^serialize$/ && $2 ~ /^3$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "serialize"},
+                            {"column": "2", "value": "3"}
+                        ],
                     "x": "3",
                     "y": "($9 - $4)",
                     "title": "k=3",
@@ -1682,7 +1814,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^serialize$/ && $2 ~ /^4$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "serialize"},
+                            {"column": "2", "value": "4"}
+                        ],
                     "x": "3",
                     "y": "($9 - $4)",
                     "title": "k=4",
@@ -1693,7 +1830,12 @@ TARGET = [
                         ]
                 },
                 {
-                    "input": "< awk '$1 ~ /^serialize$/ && $2 ~ /^5$/' benchmark/vicbf-benchmark.txt",
+                    "input": "benchmark/vicbf-benchmark.txt",
+                    "filter":
+                        [
+                            {"column": "1", "value": "serialize"},
+                            {"column": "2", "value": "5"}
+                        ],
                     "x": "3",
                     "y": "($9 - $4)",
                     "title": "k=5",
@@ -1781,8 +1923,198 @@ TARGET = [
     },  # End of VICBF serialization size with full strategy
 ]
 
-for target in TARGET:
-    print "Generate:", target["title"], "=>", target["output"]
+
+# Data lines of the input files by path, see lines()
+LINES = {}
+# Data lines of the input files by path and column values, see select()
+INDEX = {}
+# Columns of the input files by path and (column, type), see table()
+TABLES = {}
+# Evaluated x and y columns by path, filter and term, see series()
+SERIES = {}
+# Tokens of the terms NumPy evaluates: columns ($N), numbers and arithmetic
+TOKEN = re.compile(r"\s*(?:\$(\d+)|(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+)|"
+                   r"([-+*/()]))")
+
+
+def filters(plot):
+    """Return the (column, value) conditions of a plot.
+
+    The "filter" of a plot is a {"column": ..., "value": ...} dict or a list
+    of them; a row is plotted if all its columns (numbered from 1, like in
+    gnuplot) have the values.
+    """
+    conditions = plot.get("filter", [])
+    if isinstance(conditions, dict):
+        conditions = [conditions]
+    return [(int(c["column"]), c["value"]) for c in conditions]
+
+
+def lines(path):
+    """Return the (fields, line) of all data lines of a file.
+
+    Comments and empty lines are left out. Every file is only read once.
+    """
+    if path not in LINES:
+        data = []
+        with open(path, "r") as fi:
+            for line in fi:
+                fields = line.split()
+                if fields and not fields[0].startswith("#"):
+                    data.append((fields, line.rstrip("\n")))
+        LINES[path] = data
+    return LINES[path]
+
+
+def select(path, conditions):
+    """Return the (fields, line) of the data lines that match all conditions.
+
+    The file is indexed by the columns of the conditions once, so plots
+    that select different values of the same columns share the index.
+    """
+    columns = tuple(column for column, _ in conditions)
+    if (path, columns) not in INDEX:
+        index = {}
+        for fields, line in lines(path):
+            if len(fields) >= max(columns):
+                key = tuple(fields[column - 1] for column in columns)
+                index.setdefault(key, []).append((fields, line))
+        INDEX[path, columns] = index
+    return INDEX[path, columns].get(tuple(value for _, value in conditions),
+                                    [])
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def terms(plot):
+    """Return the colon-separated terms of the x and y of a plot."""
+    return (plot["x"] + ":" + plot["y"]).split(":")
+
+
+def used(terms, conditions):
+    """Return the (0-based column, type) pairs needed to evaluate terms.
+
+    Columns filtered by a text value (like "insert") are strings, all
+    others floats.
+    """
+    pairs = set()
+    for source in [translate(term) for term in terms]:
+        pairs.update((int(j), float)
+                     for j in re.findall(r"c\[(\d+)\]", source or ""))
+    pairs.update((column - 1, float if _is_number(value) else str)
+                 for column, value in conditions)
+    return pairs or set([(0, float)])  # to know the number of rows
+
+
+def table(path, pairs):
+    """Return {(column, type): array} of a file for the given pairs.
+
+    The first request for a file loads the columns all plots of TARGET
+    need from it in one pass of columns.load_columns, missing values are
+    NaN.
+    """
+    loaded = TABLES.setdefault(path, {})
+    missing = set(pairs) - set(loaded)
+    if missing and not loaded:
+        for target in TARGET:
+            for plot in target["plot"]:
+                if plot["input"] == path:
+                    missing.update(used(terms(plot), filters(plot)))
+    while missing:
+        # A column is only loaded as one type per pass
+        dtype = dict(missing)
+        cols = load_columns(path, sorted(dtype),
+                            dict((j, np.float64 if t is float else str)
+                                 for j, t in dtype.items()))
+        for j, t in dtype.items():
+            loaded[j, t] = cols[j]
+        missing -= set(dtype.items())
+    return loaded
+
+
+def translate(term):
+    """Return a term of x or y as Python expression on the columns c.
+
+    Returns None for terms NumPy cannot evaluate, which are left to gnuplot.
+    """
+    if term.strip().isdigit():
+        term = "$" + term.strip()
+    source = ""
+    position = 0
+    term = term.rstrip()
+    while position < len(term):
+        match = TOKEN.match(term, position)
+        if match is None:
+            return None
+        column, number, operator = match.groups()
+        if column is not None:
+            if int(column) == 0:
+                return None  # the row number, not a column
+            source += "c[{0}]".format(int(column) - 1)
+        else:
+            source += " " + (number or operator) + " "
+        position = match.end()
+    return source
+
+
+def series(path, conditions, term):
+    """Return a term of x or y evaluated on the filtered rows of a file.
+
+    Every term is evaluated once per file and filter, so targets that plot
+    the same column share it. Returns None if gnuplot has to evaluate it.
+    """
+    key = (path, tuple(conditions), term)
+    if key not in SERIES:
+        source = translate(term)
+        result = None
+        if source is not None:
+            pairs = used([term], conditions)
+            data = table(path, pairs)
+            rows = np.ones(len(data[min(pairs)]), dtype=bool)
+            for column, value in conditions:
+                if _is_number(value):
+                    rows &= data[column - 1, float] == float(value)
+                else:
+                    rows &= data[column - 1, str] == value
+            columns = dict((j, data[j, t][rows]) for j, t in pairs
+                           if t is float)
+            try:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    result = eval(source, {"__builtins__": {}},
+                                  {"c": columns})
+                result = np.asarray(result, dtype=float) + \
+                    np.zeros(rows.sum())
+            except (SyntaxError, ZeroDivisionError):
+                result = None
+        SERIES[key] = result
+    return SERIES[key]
+
+
+def evaluate(plot):
+    """Return the x and y columns of a plot as an array, one row per point.
+
+    Points with a missing or undefined value are left out, like gnuplot
+    does. Returns None if gnuplot has to read the input itself.
+    """
+    if np is None or not os.path.exists(plot["input"]):
+        return None
+    conditions = filters(plot)
+    columns = [series(plot["input"], conditions, term)
+               for term in terms(plot)]
+    if any(column is None for column in columns):
+        return None
+    data = np.column_stack(columns)
+    return data[np.isfinite(data).all(axis=1)]
+
+
+def script(target):
+    """Return the gnuplot script of a target."""
     # Fill in the template
     output = TEMPLATE.format(TERMINAL,
                              OUTPUT_PREFIX + target["output"],
@@ -1796,18 +2128,33 @@ for target in TARGET:
         for option in target["options"]:
             output += option + "\n"
 
-    # Add plot commands
+    # Add plot commands, with the evaluated columns or the filtered rows in
+    # data blocks before them
     plotcmd = "plot "
+    blocks = 0
     for plot in target["plot"]:
-        target = ""
-        if "filter" in plot.keys():
-            target = "< awk '${0} ~ /^{1}$/' {2}".format(plot["filter"]["column"],
-                                                         plot["filter"]["value"],
-                                                         plot["input"])
+        conditions = filters(plot)
+        using = plot["x"] + ":" + plot["y"]
+        data = evaluate(plot)
+        if data is not None:
+            rows = [" ".join(repr(value) for value in row)
+                    for row in data.tolist()]
+            using = ":".join(str(j + 1) for j in range(data.shape[1]))
+        elif conditions and os.path.exists(plot["input"]):
+            rows = [line for _, line in select(plot["input"], conditions)]
         else:
-            target = plot["input"]
+            rows = None
+        if rows is not None:
+            source = "$data{0}".format(blocks)
+            blocks += 1
+            output += source + " << EOD\n"
+            output += "".join(row + "\n" for row in rows)
+            output += "EOD\n"
+        else:
+            # A missing input is left to gnuplot to report
+            source = '"' + plot["input"] + '"'
 
-        plotcmd += '"' + target + '" u ' + plot["x"] + ":" + plot["y"] + ' '
+        plotcmd += source + ' u ' + using + ' '
         plotcmd += "w " + plot["type"] + " "
         if plot["options"] is not None:
             for option in plot["options"]:
@@ -1823,8 +2170,248 @@ for target in TARGET:
         plotcmd += ", "
     # Merge plot commands into output
     output += plotcmd[:-2] + "\n"
+    return output
+
 
-    # Execute command to generate Gnuplot
-    pobj = Popen(['/usr/bin/gnuplot'], stdin=PIPE)
-    pobj.communicate(input=output)
-    pobj.wait()
+def inputs(target):
+    """Return the sorted list of files the plots of a target read."""
+    files = set()
+    for plot in target["plot"]:
+        source = plot["input"]
+        if source.startswith("<"):
+            # Shell command like "< awk '...' file", the file comes last
+            source = source.split()[-1]
+        files.add(source)
+    return sorted(files)
+
+
+def file_hash(path):
+    """Return the SHA-1 of the contents of a file, remembered per run."""
+    with DIGESTS_LOCK:
+        if path not in DIGESTS:
+            h = hashlib.sha1()
+            try:
+                with open(path, "rb") as fi:
+                    for block in iter(lambda: fi.read(1 << 20), b""):
+                        h.update(block)
+                DIGESTS[path] = h.hexdigest()
+            except IOError:
+                DIGESTS[path] = "missing"
+        return DIGESTS[path]
+
+
+def target_hash(target, text=None):
+    """Return a hash of the gnuplot script and all inputs of a target.
+
+    text is the script of the target, if it has been created already.
+    """
+    h = hashlib.sha1(script(target) if text is None else text)
+    for path in inputs(target):
+        h.update("\0" + path + "\0" + file_hash(path))
+    return h.hexdigest()
+
+
+def load_cache(path=CACHE):
+    """Return the {output: hash} of the figures rendered last time."""
+    try:
+        with open(path, "r") as fi:
+            return json.load(fi)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_cache(cache, path=CACHE):
+    with open(path, "w") as fo:
+        json.dump(cache, fo, indent=1, sort_keys=True)
+
+
+def outdated(targets, cache, hashes):
+    """Return the targets whose figure is missing or has another hash.
+
+    hashes maps the outputs of the targets to their target_hash.
+    """
+    return [t for t in targets
+            if cache.get(t["output"]) != hashes[t["output"]] or
+            not os.path.exists(OUTPUT_PREFIX + t["output"])]
+
+
+def render(target, text=None):
+    """Run gnuplot on the script of a target.
+
+    text is the script of the target, if it has been created already.
+    Returns (target, exit code, error output). The exit code is None if
+    gnuplot could not be started at all.
+    """
+    try:
+        pobj = Popen([GNUPLOT], stdin=PIPE, stderr=PIPE,
+                     close_fds=True)
+    except OSError as e:
+        return target, None, str(e) + "\n"
+    _, err = pobj.communicate(input=script(target) if text is None
+                              else text)
+    return target, pobj.returncode, err
+
+
+class Session(object):
+    """A gnuplot process that renders one target after another.
+
+    Starting gnuplot and setting up its terminal and fonts for every figure
+    takes longer than drawing most of them. A session streams the scripts
+    of its targets into one gnuplot, each followed by commands that close
+    the figure, print MARKER on the error output and reset the settings
+    for the next one. reset leaves some settings alone, see PERSISTENT:
+    those a figure changes are restored explicitly, and a figure that
+    redefines linetypes ends its gnuplot, so that the next figure starts a
+    new one. gnuplot exits on the first error in a script it reads from a
+    pipe, so a session whose gnuplot ended before the marker reports the
+    figure as failed and starts a new gnuplot for the next one.
+    """
+
+    MARKER = "plot.py: figure done"
+    # Settings that reset does not restore, by the word that sets them, and
+    # the command that restores them (None: only a new gnuplot does)
+    PERSISTENT = [
+        ("encoding", "set encoding default"),
+        ("termoption", "set termoption solid"),  # the dash mode of TERMINAL
+        ("linetype", None),
+    ]
+
+    def __init__(self):
+        self.process = None
+
+    def restore(self, target):
+        """Return (commands, restart) to undo what reset leaves of target.
+
+        restart is True if only a new gnuplot undoes it.
+        """
+        commands = ""
+        restart = False
+        for word, command in self.PERSISTENT:
+            if any(re.search(r"\b" + word + r"\b", option)
+                   for option in target["options"] or []):
+                if command is None:
+                    restart = True
+                else:
+                    commands += command + "\n"
+        return commands, restart
+
+    def render(self, target, text=None):
+        """Render a target, like render()."""
+        restore, restart = self.restore(target)
+        if self.process is None:
+            try:
+                self.process = Popen([GNUPLOT], stdin=PIPE, stderr=PIPE,
+                                     close_fds=True)
+            except OSError as e:
+                return target, None, str(e) + "\n"
+        try:
+            if text is None:
+                text = script(target)
+            self.process.stdin.write(text + "set output\n" + restore +
+                                     "set print\n"
+                                     "print '" + self.MARKER + "'\n"
+                                     "reset\n")
+            self.process.stdin.flush()
+        except IOError:
+            pass  # gnuplot is gone, its error output tells why
+        err = ""
+        for line in iter(self.process.stderr.readline, ""):
+            if line.rstrip("\n") == self.MARKER:
+                if restart:
+                    self.close()
+                return target, 0, err
+            err += line
+        code = self.process.wait()
+        self.process = None
+        # Ending before the marker is a failure, even without an exit code
+        return target, code or 1, err
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+
+
+def render_all(targets, jobs=None, session=False, scripts=None):
+    """Render the targets with up to jobs gnuplot processes at a time.
+
+    Every thread of the pool drives one gnuplot process, so jobs (default:
+    one per CPU) bounds the number of gnuplots running in parallel. With
+    session, the threads share jobs Sessions instead of starting a gnuplot
+    per target. scripts maps outputs to the scripts of the targets that
+    have been created already. A failing figure is reported and does not
+    stop the others. Returns the list of targets that failed.
+    """
+    jobs = jobs or cpu_count()
+    scripts = scripts or {}
+    sessions = Queue()
+    for _ in range(jobs if session else 0):
+        sessions.put(Session())
+
+    def work(target):
+        text = scripts.get(target["output"])
+        if not session:
+            return render(target, text)
+        current = sessions.get()
+        try:
+            return current.render(target, text)
+        finally:
+            sessions.put(current)
+    failures = []
+    pool = ThreadPool(jobs)
+    try:
+        for target, code, err in pool.imap_unordered(work, targets):
+            if code == 0:
+                print "Generated:", target["title"], "=>", target["output"]
+            else:
+                print "FAILED:", target["title"], "=>", target["output"]
+                failures.append(target)
+            if err:
+                print err.rstrip("\n")
+    finally:
+        pool.close()
+        pool.join()
+        while not sessions.empty():
+            sessions.get().close()
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the GnuPlot plots.")
+    parser.add_argument("outputs", nargs="*", metavar="output",
+                        help="only create these figures, e.g. "
+                        "impl-simu-share-time.eps (default: all)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of gnuplots to run in parallel "
+                        "(default: one per CPU)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="render all figures, even unchanged ones")
+    parser.add_argument("-s", "--session", action="store_true",
+                        help="keep one gnuplot running per job instead of "
+                        "starting one per figure")
+    args = parser.parse_args()
+    selected = [t for t in TARGET
+                if not args.outputs or t["output"] in args.outputs]
+    unknown = set(args.outputs) - set(t["output"] for t in selected)
+    if unknown:
+        parser.error("unknown figure: " + ", ".join(sorted(unknown)))
+    cache = load_cache()
+    scripts = dict((t["output"], script(t)) for t in selected)
+    hashes = dict((t["output"], target_hash(t, scripts[t["output"]]))
+                  for t in selected)
+    todo = selected if args.force else outdated(selected, cache, hashes)
+    if len(todo) < len(selected):
+        print len(selected) - len(todo), "figures are up to date"
+    failures = render_all(todo, args.jobs, args.session, scripts)
+    failed = set(t["output"] for t in failures)
+    for t in todo:
+        if t["output"] in failed:
+            cache.pop(t["output"], None)
+        else:
+            cache[t["output"]] = hashes[t["output"]]
+    save_cache(cache)
+    if failures:
+        print len(failures), "of", len(todo), "figures failed:", \
+            ", ".join(t["output"] for t in failures)
+        sys.exit(1)
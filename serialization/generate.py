@@ -1,18 +1,231 @@
 """Determine uncompressed and compressed VI-CBF size
 
 Used to compare the full and smart serialization algorithms.
-However, you'll have to switch them our manually in the VI-CBF 
-implementation. The last version of pyVICBF that still had the smart
-algorithm is commit 3eebf08 in the pyVICBF repository:
-https://github.com/malexmave/pyVICBF/blob/3eebf080d271d77d5dadd13141447392637bdd3c/vicbf/vicbf.py"""
-
-from vicbf.vicbf import VICBF
-from zlib import compress
-
-v = VICBF(10000, 3)
-for i in range(10000):
-    v.insert(i)
-    if i % 10 == 0:
-        x = v.serialize().tobytes()
-        y = compress(x, 6)
-        print i, len(x), len(y), v.FPR()
+The measurements in this folder were made with pyVICBF, where you had to
+switch them our manually in the VI-CBF implementation. The last version of
+pyVICBF that still had the smart algorithm is commit 3eebf08 in the pyVICBF
+repository:
+https://github.com/malexmave/pyVICBF/blob/3eebf080d271d77d5dadd13141447392637bdd3c/vicbf/vicbf.py
+
+The original script serialized and compressed the whole filter from scratch
+after every 10 inserts, which is quadratic in the size of the filter. This
+version uses the bulk builder from ../code/vicbfsize.py and a SizeTracker
+that keeps the counter histogram up to date as entries are inserted, so the
+uncompressed sizes are known at any time. Only at the checkpoints the filter
+is serialized and compressed, so filters with millions of slots can be swept
+as well.
+
+Both formats are implemented in ../code/vicbfserial.py, so a single run
+measures both of them, and which one vicbfserial.serialize() picks (format
+0 is full, 1 is smart) together with its size:
+
+    python generate.py [-m SLOTS] [-k HASH_FUNCTIONS] [-n ENTRIES]
+                       [-s STEP | -p POINTS] [-f all|full|smart]
+
+-f full and -f smart print the four columns of the data files instead, the
+smart format falling back to the full one when that is smaller, like pyVICBF
+did:
+
+    python generate.py -f smart > vicbf-serialization-size-smart.txt
+
+With --benchmark, every checkpoint is compressed with all codecs of
+../code/vicbfcodec.py (or those given with -c) instead, and one line per
+codec reports the compressed size, the ratio and the compress and
+decompress time:
+
+    python generate.py --benchmark -p 20 [-c zlib-6 -c bz2-9 ...]
+
+The defaults reproduce the sweep of the data files (10000 slots, 3 hash
+functions, a checkpoint every 10 inserts). Like before, the line for key i
+describes the filter after inserting the keys 0..i.
+"""
+
+import argparse
+import os
+import sys
+import zlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "code"))
+from cbfparams import calculate_fpr
+from vicbfserial import (FULL, SMART, choose, full_size, serialize_full,
+                         serialize_smart, smart_size)
+from vicbfsize import BLOCK, COUNTER_MAX, BulkVICBF
+import vicbfcodec
+
+ZLIB_LEVEL = 6
+SERIALIZERS = {FULL: serialize_full, SMART: serialize_smart}
+
+
+class SizeTracker(object):
+    """VI-CBF that tracks its counter histogram while keys are inserted.
+
+    histogram[v] is the number of counters with the value v. Inserting keys
+    only updates the histogram for the slots they touch, so the serialized
+    size without compression is available without looking at all counters.
+    """
+
+    def __init__(self, slots, hash_functions, dlbase=4):
+        self.filter = BulkVICBF(slots, hash_functions, dlbase)
+        self.histogram = np.zeros(COUNTER_MAX + 1, dtype=np.int64)
+        self.histogram[0] = slots
+
+    @property
+    def entries(self):
+        return self.filter.entries
+
+    def insert_range(self, start, stop):
+        """Insert the keys start..stop-1."""
+        for first in range(int(start), int(stop), BLOCK):
+            keys = np.arange(first, min(first + BLOCK, int(stop)),
+                             dtype=np.uint64)
+            idx, inc = self.filter.positions(keys)
+            touched = np.unique(idx)
+            self.histogram -= np.bincount(self.filter.get(touched),
+                                          minlength=COUNTER_MAX + 1)
+            self.filter.add(idx, inc)
+            self.filter.entries += len(keys)
+            self.histogram += np.bincount(self.filter.get(touched),
+                                          minlength=COUNTER_MAX + 1)
+
+    def nonzero(self):
+        """Return the number of counters that are not zero."""
+        return self.filter.slots - int(self.histogram[0])
+
+    def size(self, kind):
+        """Return the uncompressed size of the filter in a format."""
+        if kind == SMART:
+            return smart_size(self.nonzero(), self.filter.slots)
+        return full_size(self.filter.slots)
+
+    def choose(self, compressed=True):
+        """Return the format vicbfserial.serialize() would use."""
+        return choose(self.nonzero(), self.filter.slots, compressed)
+
+    def serialize(self, kind, counters=None):
+        """Serialize the filter in a format."""
+        if counters is None:
+            counters = self.filter.counters
+        return SERIALIZERS[kind](counters, self.filter.hash_functions,
+                                 self.entries)
+
+    def snapshot(self, kinds=(FULL, SMART), level=ZLIB_LEVEL):
+        """Serialize and compress the filter in the given formats.
+
+        Returns {format: (uncompressed, compressed) size}.
+        """
+        counters = self.filter.counters
+        sizes = {}
+        for kind in kinds:
+            serialized = self.serialize(kind, counters)
+            sizes[kind] = (len(serialized),
+                           len(zlib.compress(serialized, level)))
+        return sizes
+
+
+def checkpoints(entries, step=10, points=None):
+    """Return the sorted keys after which a line is printed.
+
+    Either every step-th key like the original script, or about points
+    geometrically spaced keys.
+    """
+    if points is None:
+        return list(range(0, entries, step))
+    keys = np.unique(np.geomspace(1, entries, points).astype(np.int64) - 1)
+    return [int(i) for i in keys]
+
+
+def sweep(slots, hash_functions, keys, dlbase=4):
+    """Yield (key, chosen format, sizes, fpr) for every checkpoint.
+
+    sizes is the snapshot of both formats, see SizeTracker.snapshot.
+    """
+    tracker = SizeTracker(slots, hash_functions, dlbase)
+    for i in keys:
+        tracker.insert_range(tracker.entries, i + 1)
+        yield (i, tracker.choose(), tracker.snapshot(),
+               calculate_fpr(i + 1, slots, dlbase, hash_functions))
+
+
+def legacy_sweep(slots, hash_functions, keys, kind, dlbase=4):
+    """Yield (key, uncompressed, compressed, fpr) for a single format.
+
+    The smart format falls back to the full one when that is smaller.
+    """
+    tracker = SizeTracker(slots, hash_functions, dlbase)
+    for i in keys:
+        tracker.insert_range(tracker.entries, i + 1)
+        if kind == SMART:
+            kind_now = tracker.choose(compressed=False)
+        else:
+            kind_now = FULL
+        uncompressed, compressed = tracker.snapshot([kind_now])[kind_now]
+        yield (i, uncompressed, compressed,
+               calculate_fpr(i + 1, slots, dlbase, hash_functions))
+
+
+def benchmark_sweep(slots, hash_functions, keys, kind=None, codecs=None,
+                    dlbase=4):
+    """Yield (key, fill, format, uncompressed size, benchmark results) for
+    every checkpoint.
+
+    kind is the format to benchmark, by default the one vicbfserial picks.
+    The results are those of vicbfcodec.benchmark.
+    """
+    tracker = SizeTracker(slots, hash_functions, dlbase)
+    for i in keys:
+        tracker.insert_range(tracker.entries, i + 1)
+        kind_now = tracker.choose() if kind is None else kind
+        serialized = tracker.serialize(kind_now)
+        yield (i, tracker.nonzero() / float(slots), kind_now,
+               len(serialized), vicbfcodec.benchmark(serialized, codecs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sweep the serialized size of a filling VI-CBF.")
+    parser.add_argument("-m", "--slots", type=int, default=10000)
+    parser.add_argument("-k", "--hash-functions", type=int, default=3)
+    parser.add_argument("-n", "--entries", type=int, default=10000)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-s", "--step", type=int, default=10,
+                       help="print a line every STEP inserts (default: 10)")
+    group.add_argument("-p", "--points", type=int, default=None,
+                       help="print about POINTS geometrically spaced lines")
+    parser.add_argument("-f", "--format", default="all",
+                        choices=["all", "full", "smart"],
+                        help="print both formats and the chosen one "
+                        "(default), or a single format like the data files")
+    parser.add_argument("-b", "--benchmark", action="store_true",
+                        help="compare compression codecs instead")
+    parser.add_argument("-c", "--codec", action="append",
+                        choices=vicbfcodec.codec_names(),
+                        help="codec to benchmark (default: all)")
+    args = parser.parse_args()
+    keys = checkpoints(args.entries, args.step, args.points)
+    if args.benchmark:
+        print("# Entries fill format codec uncompressed compressed ratio "
+              "compress_us decompress_us")
+        kind = {"all": None, "full": FULL, "smart": SMART}[args.format]
+        for i, fill, kind_now, uncompressed, results in benchmark_sweep(
+                args.slots, args.hash_functions, keys, kind, args.codec):
+            for name, size, ratio, compress, decompress in results:
+                print("{0} {1:.6f} {2} {3} {4} {5} {6:.6f} {7:.1f} "
+                      "{8:.1f}".format(i, fill, kind_now, name, uncompressed,
+                                       size, ratio, compress * 1e6,
+                                       decompress * 1e6))
+    elif args.format == "all":
+        print("# Entries full full_compressed smart smart_compressed "
+              "format chosen chosen_compressed fpr")
+        for i, kind, sizes, fpr in sweep(args.slots, args.hash_functions,
+                                         keys):
+            print("{0} {1} {2} {3} {4} {5} {6} {7} {8}".format(
+                i, sizes[FULL][0], sizes[FULL][1], sizes[SMART][0],
+                sizes[SMART][1], kind, sizes[kind][0], sizes[kind][1], fpr))
+    else:
+        kind = FULL if args.format == "full" else SMART
+        print("# Entries uncompressed compressed fpr")
+        for row in legacy_sweep(args.slots, args.hash_functions, keys, kind):
+            print("{0} {1} {2} {3}".format(*row))